@@ -0,0 +1,66 @@
+import sys
+import os
+import time
+from rebuild_soundbank import Soundbank, SoundbankError, Encodable
+
+def benchmark(path, rounds):
+    parse = 0.0
+    encode = 0.0
+    size = 0
+    count = 0
+
+    for i in xrange(rounds):
+        soundbank = Soundbank(path)
+        soundbank.read()
+
+        objects = [obj for obj in soundbank.objects.objects]
+        size = sum(obj.length for obj in objects)
+        count = len(objects)
+
+        start = time.time()
+
+        for obj in objects:
+            obj.obj
+
+        parse += time.time() - start
+        start = time.time()
+
+        for obj in objects:
+            if isinstance(obj.obj, Encodable):
+                obj.obj.invalidate()
+                obj.obj.encode()
+
+        encode += time.time() - start
+
+    return (count, size, parse / rounds, encode / rounds)
+
+def main(argc, argv):
+    if argc not in (2, 3):
+        print "Usage: %s <BNK> [ROUNDS]" % (os.path.basename(argv[0]))
+        sys.exit(1)
+
+    try:
+        rounds = int(argv[2]) if argc == 3 else 5
+    except ValueError:
+        rounds = 0
+
+    if rounds < 1:
+        print "Invalid rounds count"
+        sys.exit(1)
+
+    (count, size, parse, encode) = benchmark(argv[1], rounds)
+
+    print "Objects: %i (%i bytes), %i rounds" % (count, size, rounds)
+
+    for (phase, seconds) in (("Parse", parse), ("Serialize", encode)):
+        if seconds > 0:
+            print "%-10s %8.3fs %10.0f objects/s %8.2f MB/s" % (phase, seconds, count / seconds, size / seconds / 0x100000)
+        else:
+            print "%-10s %8.3fs %10s objects/s %8s MB/s" % (phase, seconds, "-", "-")
+
+if __name__ == "__main__":
+    try:
+        main(len(sys.argv), sys.argv)
+    except SoundbankError as e:
+        print e
+        sys.exit(1)
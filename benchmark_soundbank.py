@@ -0,0 +1,468 @@
+import sys
+import os
+import time
+import json
+import struct
+import shutil
+import tempfile
+import platform
+import subprocess
+from rebuild_soundbank import (Soundbank, SoundbankError, SBHeader, SBDataIndex, SBDataTable, SBData, SBObjects,
+                               SBObject, SBObjectIDs, SBSoundTypeID, SoundStructure, SBSoundObject,
+                               SBEventActionObject, SBEventObject, SBMusicTrackCustomObject, SBMusicSegmentObject,
+                               SBMusicPlaylistObject, MusicPlaylistObject_Transition,
+                               MusicPlaylistObject_PlaylistElement, WEM)
+
+BANK_ID = 0x0BE4C400
+FIRST_OBJECT_ID = 100000000
+FIRST_WEM_ID = 200000000
+FIRST_MUSIC_ID = 300000000
+SAMPLE_RATE = 48000
+WEM_SIZE = 0x4000
+WEM_HEADER_SIZE = 98
+ACTION_TYPE_PLAY = 0x04
+
+def make_wem(samples, size=0):
+    """ Returns a minimal Vorbis WEM readable by compare_wem, padded up to size bytes. """
+
+    vorb = struct.pack("<IIIIIIIIIIBB", samples, 0x4A, 0, 0, 0, 4, 0, 0, 0, 0, 8, 11)
+    fmt = struct.pack("<HHIIHHHHI", 0xFFFF, 2, SAMPLE_RATE, 10000, 0, 0, 0x30, 0, 3) + vorb
+    data = struct.pack("<HH", 2, 0) + "\0" * max(size - WEM_HEADER_SIZE, 0)
+    body = "WAVE" + "fmt " + struct.pack("<I", len(fmt)) + fmt + "data" + struct.pack("<I", len(data)) + data
+
+    return "RIFF" + struct.pack("<I", len(body)) + body
+
+def make_structure(parent_id=0, positioning=False):
+    structure = SoundStructure()
+    structure.effects_override = False
+    structure.effects_count = 0
+    structure.output_bus_id = 0
+    structure.parent_id = parent_id
+    structure.override_playback_priority = False
+    structure.offset_priority = False
+    structure.additional_parameters_count = 0
+    structure.has_positioning = positioning
+    structure.positioning_type = 0x2D
+    structure.enable_panner = False
+    structure.override_game_auxiliary_sends = False
+    structure.use_game_auxiliary_sends = False
+    structure.override_user_auxiliary_sends = False
+    structure.user_auxiliary_sends_exists = False
+    structure.unk_field8_2 = False
+    structure.how_to_limit_sound_instances = 0
+    structure.virtual_voice_behavior = 0
+    structure.override_playback_limit = False
+    structure.override_virtual_voice = False
+    structure.state_groups_count = 0
+    structure.rtpc_count = 0
+    structure.unk_field32_3 = 0
+
+    return structure
+
+def make_object(type, id, obj):
+    sbobject = SBObject()
+    sbobject.type = type
+    sbobject.id = id
+    sbobject.obj = obj
+    sbobject.calculate_length()
+
+    return sbobject
+
+def make_event(objects, target_id, new_id):
+    action = SBEventActionObject()
+    action.scope = 0x03
+    action.type = ACTION_TYPE_PLAY
+    action.game_object_id = target_id
+    action.additional_parameters_count = 0
+    action.unk_data = struct.pack("<BI", 0x04, BANK_ID)
+
+    event = SBEventObject()
+    event.event_actions = 1
+    event.event_action_ids = [new_id()]
+
+    objects.append(make_object(SBObject.TYPE_EVENT_ACTION, event.event_action_ids[0], action))
+    objects.append(make_object(SBObject.TYPE_EVENT, new_id(), event))
+
+def make_segment(sid, track_id, time_length):
+    segment = SBMusicSegmentObject()
+    segment.sound_structure = make_structure()
+    segment.children = 1
+    segment.child_ids = [track_id]
+    segment.unk_double_1 = 1000.0
+    segment.unk_field64_1 = 0
+    segment.tempo = 120.0
+    segment.time_sig1 = 4
+    segment.time_sig2 = 4
+    segment.unk_field32_1 = 0
+    segment.unk_field8_1 = 0
+    segment.time_length = time_length
+    segment.unk_field32_2 = 0
+    segment.unk_field32_3 = 0
+    segment.unk_field64_2 = 0
+    segment.unk_field32_4 = 0
+    segment.unk_field32_5 = 0
+    segment.time_length_next = time_length
+    segment.unk_field32_6 = 0
+    segment.unk_data = None
+
+    return make_object(SBObject.TYPE_MUSIC_SEGMENT, sid, segment)
+
+def make_playlist(pid, segment_ids, new_id):
+    transition = MusicPlaylistObject_Transition()
+
+    for name in MusicPlaylistObject_Transition.RECORD.names:
+        if getattr(transition, name) is None:
+            setattr(transition, name, 0)
+
+    transition.source_id = 0xFFFFFFFF
+    transition.dest_id = 0xFFFFFFFF
+    transition.has_segment = False
+
+    root = MusicPlaylistObject_PlaylistElement()
+    root.music_segment_id = 0
+    root.id = new_id()
+    root.child_elements = len(segment_ids)
+    root.playlist_type = 0
+    root.loop_count = 0
+    root.weight = 50000
+    root.times_in_row = 1
+    root.random_type = 0
+
+    playlist = SBMusicPlaylistObject()
+    playlist.sound_structure = make_structure()
+    playlist.segments = len(segment_ids)
+    playlist.segment_ids = list(segment_ids)
+    playlist.unk_double_1 = 1000.0
+    playlist.unk_field64_1 = 0
+    playlist.tempo = 120.0
+    playlist.time_sig1 = 4
+    playlist.time_sig2 = 4
+    playlist.unk_field8_1 = 0
+    playlist.unk_field32_1 = 0
+    playlist.transition_count = 1
+    playlist.transitions = [transition]
+    playlist.playlist_elements = [root]
+
+    for sid in segment_ids:
+        element = MusicPlaylistObject_PlaylistElement()
+        element.music_segment_id = sid
+        element.id = new_id()
+        element.child_elements = 0
+        element.playlist_type = -1
+        element.loop_count = 1
+        element.weight = 50000
+        element.times_in_row = 1
+        element.random_type = 0
+
+        playlist.playlist_elements.append(element)
+
+    playlist.playlist_elements_count = len(playlist.playlist_elements)
+
+    return make_object(SBObject.TYPE_MUSIC_PLAYLIST, pid, playlist)
+
+def generate(path, sounds, segments, playlists, wems, wem_size=WEM_SIZE):
+    """ Writes a soundbank with the given number of sounds (one play event each), music segments (one
+    streamed track each), playlists sharing the segments (one play event each) and embedded WEMs, which
+    the sounds use in turn. Ids are sequential, so the same arguments always give the same bank. """
+
+    ids = iter(xrange(FIRST_OBJECT_ID, 0xFFFFFFFF))
+    new_id = ids.next
+
+    soundbank = Soundbank()
+    soundbank.header = SBHeader()
+    soundbank.header.length = 0x10
+    soundbank.header.id = BANK_ID
+
+    soundbank.data_index = SBDataIndex()
+    soundbank.data = SBData()
+
+    if wems > 0:
+        wem_ids = range(FIRST_WEM_ID, FIRST_WEM_ID + wems)
+        table = SBDataTable(struct.pack("<%iI" % (wems * 3), *[field for wid in wem_ids for field in (wid, 0, 0)]))
+
+        for i in xrange(wems):
+            wem = WEM()
+            wem.id = wem_ids[i]
+            wem.data = make_wem(SAMPLE_RATE, wem_size)
+            wem.size = len(wem.data)
+            table.replace(i, wem)
+
+        soundbank.data_index.data_info = table
+
+    soundbank.objects = SBObjects()
+    objects = soundbank.objects.objects
+
+    for i in xrange(sounds):
+        sound = SBSoundObject()
+        sound.unk_field32_1 = 0
+        sound.sound_type = SBSoundObject.SOUND_TYPE_SFX
+        sound.sound_structure = str(make_structure(positioning=True))
+
+        if wems > 0:
+            sound.include_type = SBSoundObject.SOUND_EMBEDDED
+            sound.audio_id = sound.source_id = FIRST_WEM_ID + (i % wems)
+            sound.offset = 0
+            sound.size = 0
+        else:
+            sound.include_type = SBSoundObject.SOUND_STREAMED
+            sound.audio_id = sound.source_id = FIRST_WEM_ID + i
+
+        sid = new_id()
+        objects.append(make_object(SBObject.TYPE_SOUND, sid, sound))
+        make_event(objects, sid, new_id)
+
+    segment_ids = []
+
+    for i in xrange(segments):
+        time_length = 1000.0 + i
+        track_id = new_id()
+        sid = new_id()
+
+        objects.append(make_object(SBObject.TYPE_MUSIC_TRACK, track_id, SBMusicTrackCustomObject(FIRST_MUSIC_ID + i, time_length, sid)))
+        objects.append(make_segment(sid, track_id, time_length))
+        segment_ids.append(sid)
+
+    for i in xrange(playlists):
+        pid = new_id()
+        objects.append(make_playlist(pid, segment_ids[i::playlists], new_id))
+        make_event(objects, pid, new_id)
+
+    soundbank.objects.calculate_length()
+
+    soundbank.stid = SBSoundTypeID()
+    soundbank.stid.length = 8
+    soundbank.stid.remaining = ""
+
+    soundbank.build_bnk(path)
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Runner(object):
+    """ Times every phase on a freshly read copy of the soundbank, the --debug-* output going to os.devnull. """
+
+    def __init__(self, path, rounds):
+        self.path = os.path.abspath(path)
+        self.rounds = rounds
+        self.results = []
+        self.work = None
+
+    def _read(self):
+        soundbank = Soundbank(self.path)
+        soundbank.read()
+
+        return soundbank
+
+    def _time(self, name, function, prepare=None):
+        times = []
+
+        for i in xrange(self.rounds):
+            argument = prepare() if prepare is not None else None
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, "w")
+
+            try:
+                start = time.time()
+                function(argument)
+                times.append(time.time() - start)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+        self.results.append((name, times))
+
+    def _targets(self):
+        soundbank = self._read()
+        objects = soundbank.objects.objects
+        first = lambda type: next((obj for obj in objects if obj.type == type), None)
+
+        self.event = first(SBObject.TYPE_EVENT)
+        self.sound = first(SBObject.TYPE_SOUND)
+        self.object = objects[0] if objects else None
+        self.track = first(SBObject.TYPE_MUSIC_TRACK)
+        self.playlist = first(SBObject.TYPE_MUSIC_PLAYLIST)
+        self.segments = len(objects.get_type(SBObject.TYPE_MUSIC_SEGMENT))
+        self.media = soundbank.data_index.data_info if soundbank.data_index else []
+        self.info = {"path": self.path, "size": os.path.getsize(self.path), "objects": len(objects),
+                     "wems": len(self.media)}
+
+        if self.track is not None:
+            self.mid = self.track.obj.id1
+            used = set(obj.obj.id1 for obj in objects.get_type(SBObject.TYPE_MUSIC_TRACK))
+            self.new_mid = max(used) + 1
+
+            for (mid, name) in ((self.mid, "music"), (self.new_mid, "new_music")):
+                os.mkdir(os.path.join(self.work, name))
+
+                with open(os.path.join(self.work, name, "%i.wem" % (mid)), "wb") as f:
+                    f.write(make_wem(SAMPLE_RATE * 2))
+
+        os.mkdir(os.path.join(self.work, "wems"))
+
+        for data_info in list(self.media)[::10]:
+            with open(os.path.join(self.work, "wems", "%i.wem" % (data_info.id)), "wb") as f:
+                f.write(str(data_info.data))
+
+        return soundbank
+
+    def run(self):
+        cwd = os.getcwd()
+        self.work = tempfile.mkdtemp()
+
+        try:
+            # add_music allocates ids against objectids.db in the working directory.
+            for folder in (cwd, os.path.dirname(os.path.abspath(__file__))):
+                if os.path.isfile(os.path.join(folder, SBObjectIDs.PATH)):
+                    for name in (SBObjectIDs.PATH, SBObjectIDs.PATH + SBObjectIDs.SORTED_EXT):
+                        if os.path.isfile(os.path.join(folder, name)):
+                            shutil.copy(os.path.join(folder, name), self.work)
+
+                    break
+
+            os.chdir(self.work)
+            self._run()
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(self.work, True)
+
+        return self.results
+
+    def _run(self):
+        loaded = self._targets()
+        output = os.path.join(self.work, "output.bnk")
+
+        self._time("read", lambda none: self._read())
+        self._time("debug", lambda none: loaded.debug())
+
+        if self.event is not None:
+            self._time("debug_event", lambda none: loaded.debug_event(self.event.id))
+
+        if self.sound is not None:
+            self._time("debug_sound", lambda none: loaded.debug_sound(self.sound.id))
+
+        if self.object is not None:
+            self._time("debug_object", lambda none: loaded.debug_object(self.object.id))
+
+        if self.media:
+            self._time("debug_owner", lambda none: loaded.debug_owner(self.media[0].id))
+
+        if self.object is not None:
+            self._time("debug_references", lambda none: loaded.debug_references(self.object.id))
+
+        if self.track is not None and self.playlist is not None:
+            self._time("playlist_id_from_track", lambda none: loaded.get_playlist_ids(self.mid))
+
+        loaded = None
+
+        def rebuild(soundbank):
+            soundbank.read_wems(os.path.join(self.work, "wems"))
+            soundbank.rebuild_data()
+            soundbank.build_bnk(output)
+
+        if self.media:
+            self._time("rebuild_data+build_bnk", rebuild, self._read)
+
+        if self.track is not None:
+            def rebuild_music(soundbank):
+                soundbank.rebuild_music(os.path.join(self.work, "music", "%i.wem" % (self.mid)))
+                soundbank.build_bnk(output)
+
+            def add_music(soundbank):
+                soundbank.add_music(os.path.join(self.work, "new_music", "%i.wem" % (self.new_mid)))
+                soundbank.build_bnk(output)
+
+            self._time("rebuild_music+build_bnk", rebuild_music, self._read)
+
+            if self.segments > 0:
+                self._time("add_music+build_bnk", add_music, self._read)
+
+        if self.playlist is not None:
+            def reimport_playlist(soundbank):
+                soundbank.reimport_playlist(self.playlist.id)
+                soundbank.build_bnk(output)
+
+            self._time("export_playlist", lambda soundbank: soundbank.export_playlist(self.playlist.id), self._read)
+            self._time("reimport_playlist+build_bnk", reimport_playlist, self._read)
+
+    def report(self):
+        return {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rounds": self.rounds,
+            "bank": self.info,
+            "phases": [{"name": name, "min": min(times), "mean": sum(times) / len(times), "max": max(times)}
+                       for (name, times) in self.results]
+        }
+
+def show_usage(path):
+    name = os.path.basename(path)
+
+    print "Usage: %s <BNK> [ROUNDS] [JSON|-]" % (name)
+    print "       %s --generate <BNK> <SOUNDS> <SEGMENTS> <PLAYLISTS> [WEMS] [WEM SIZE]" % (name)
+    sys.exit(1)
+
+def main(argc, argv):
+    if argc < 2:
+        show_usage(argv[0])
+
+    try:
+        if argv[1] == "--generate":
+            if argc not in (6, 7, 8):
+                show_usage(argv[0])
+
+            (sounds, segments, playlists) = (int(arg) for arg in argv[3:6])
+            wems = int(argv[6]) if argc >= 7 else sounds
+            wem_size = int(argv[7], 0) if argc == 8 else WEM_SIZE
+
+            if min(sounds, segments, playlists, wems, wem_size) < 0:
+                raise ValueError
+
+            sys.stdout.write("Generating soundbank...")
+            generate(argv[2], sounds, segments, playlists, wems, wem_size)
+            print "Done!"
+
+            return
+
+        if argc > 4:
+            show_usage(argv[0])
+
+        rounds = int(argv[2]) if argc >= 3 else 5
+
+        if rounds < 1:
+            raise ValueError
+    except ValueError:
+        print "Invalid count"
+        sys.exit(1)
+
+    runner = Runner(argv[1], rounds)
+    runner.run()
+    report = runner.report()
+
+    if argc == 4 and argv[3] == "-":
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print
+
+        return
+
+    print "%s: %i bytes, %i objects, %i WEMs, %i rounds" % (report["bank"]["path"], report["bank"]["size"],
+                                                            report["bank"]["objects"], report["bank"]["wems"], rounds)
+
+    for phase in report["phases"]:
+        print "%-28s %8.4fs min %8.4fs mean %8.4fs max" % (phase["name"], phase["min"], phase["mean"], phase["max"])
+
+    if argc == 4:
+        with open(argv[3], "wt") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    try:
+        main(len(sys.argv), sys.argv)
+    except SoundbankError as e:
+        print e
+        sys.exit(1)
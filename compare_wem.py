@@ -165,7 +165,7 @@ class WEM(object):
     def _write_uint32(self, data):
         self.buffer.write(struct.pack("<I", data))
 
-    def read(self):
+    def read(self, headers_only=False):
         try:
             self.riff_head = self._read_uchar(4)
 
@@ -348,6 +348,9 @@ class WEM(object):
             if self.subtype in (4, 3, 0x33, 0x37, 0x3b, 0x3f):
                 pass
 
+            if headers_only:
+                return
+
             self.setup_packet()
 
             self.file.seek(self.data_offset, WEMTypes.SEEK_BEGIN)
@@ -1,8 +1,21 @@
 import sys
 import os
 import struct
+import mmap
+import time
+import csv
+import cmd
+import shlex
+import multiprocessing
+import multiprocessing.pool
+import sqlite3
+import json
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
 from cStringIO import StringIO
 from copy import deepcopy
+from functools import wraps
 from binascii import hexlify
 from hashlib import sha1
 from ConfigParser import SafeConfigParser
@@ -35,6 +48,12 @@ class SBManagerError(SoundbankError):
 class SBEnvironmentsError(SoundbankError):
     pass
 
+class SBCorpusError(SoundbankError):
+    pass
+
+class WEMStoreError(SoundbankError):
+    pass
+
 class SoundbankChunk(object):
     pass
 
@@ -114,6 +133,405 @@ class Random(object):
     def double(cls):
         return struct.unpack("<d", cls.seed(8))[0]
 
+class Profile(object):
+    """ Wall time, bytes and object counts per phase, for --profile. """
+
+    enabled = False
+    clock = time.time
+    origin = None
+    depth = 0
+    phases = OrderedDict()
+    events = []
+
+    @classmethod
+    def enable(cls):
+        cls.enabled = True
+        cls.origin = cls.clock()
+        cls.depth = 0
+        cls.phases.clear()
+        del cls.events[:]
+
+    @classmethod
+    def span(cls, name):
+        if not cls.enabled:
+            return ProfileSpan.NULL
+
+        return ProfileSpan(name)
+
+    @classmethod
+    def phase(cls, name):
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not cls.enabled:
+                    return function(*args, **kwargs)
+
+                with ProfileSpan(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    @classmethod
+    def get(cls, name, depth):
+        """ Returns [depth, calls, seconds, bytes, objects] of a phase, listed in the order phases start. """
+
+        phase = cls.phases.get(name)
+
+        if phase is None:
+            phase = cls.phases[name] = [depth, 0, 0.0, 0, 0]
+
+        return phase
+
+    @classmethod
+    def add(cls, name, seconds, size=0, count=0, phase=None):
+        if phase is None:
+            phase = cls.get(name, cls.depth)
+
+        phase[1] += 1
+        phase[2] += seconds
+        phase[3] += size
+        phase[4] += count
+
+    @classmethod
+    def report(cls):
+        print
+        print "%-36s %7s %9s %12s %10s %9s" % ("Phase", "Calls", "Objects", "Bytes", "Seconds", "MB/s")
+
+        for (name, (depth, calls, seconds, size, count)) in cls.phases.iteritems():
+            speed = "%9.2f" % (size / seconds / 0x100000) if size and seconds > 0 else "%9s" % ("-")
+            print "%-36s %7i %9i %12i %10.4f %s" % ("  " * depth + name, calls, count, size, seconds, speed)
+
+        print "%-36s %7s %9s %12s %10.4f" % ("Total", "", "", "", cls.clock() - cls.origin)
+
+    @classmethod
+    def save_trace(cls, path):
+        try:
+            with open(path, "wt") as f:
+                json.dump({"traceEvents": cls.events, "displayTimeUnit": "ms"}, f)
+        except (OSError, IOError):
+            raise SoundbankError("Could not write profile trace")
+
+class ProfileSpan(object):
+    __slots__ = ("name", "size", "count", "phase", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 0
+        self.count = 0
+
+    def __enter__(self):
+        if self.name is not None:
+            self.phase = Profile.get(self.name, Profile.depth)
+            Profile.depth += 1
+            self.start = Profile.clock()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.name is not None:
+            seconds = Profile.clock() - self.start
+            Profile.depth -= 1
+            Profile.add(self.name, seconds, self.size, self.count, self.phase)
+            Profile.events.append({"name": self.name, "cat": "soundbank", "ph": "X", "pid": os.getpid(), "tid": 1,
+                                   "ts": (self.start - Profile.origin) * 1000000, "dur": seconds * 1000000,
+                                   "args": {"bytes": self.size, "objects": self.count}})
+
+ProfileSpan.NULL = ProfileSpan(None)
+
+class IndexedList(list):
+    """ List that keeps an id -> item index in sync with its contents. """
+
+    def __init__(self, items=()):
+        list.__init__(self, items)
+        self.reindex()
+
+    def reindex(self):
+        self._ids = {}
+
+        for item in self:
+            self._ids.setdefault(item.id, item)
+
+    def _added(self, items):
+        for item in items:
+            self._ids.setdefault(item.id, item)
+
+    def _removed(self, items):
+        for item in items:
+            if self._ids.get(item.id) is item:
+                del self._ids[item.id]
+
+                for other in self:
+                    if other.id == item.id:
+                        self._ids[item.id] = other
+                        break
+
+    def get(self, id, default=None):
+        return self._ids.get(id, default)
+
+    def append(self, item):
+        list.append(self, item)
+        self._added((item,))
+
+    def extend(self, items):
+        items = list(items)
+        list.extend(self, items)
+        self._added(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self._added((item,))
+
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self._removed((item,))
+        return item
+
+    def remove(self, item):
+        list.remove(self, item)
+        self._removed((item,))
+
+    def __setitem__(self, index, item):
+        if isinstance(index, slice):
+            old = self[index]
+            item = list(item)
+        else:
+            old = [self[index]]
+
+        list.__setitem__(self, index, item)
+        self._removed(old)
+        self._added(item if isinstance(index, slice) else (item,))
+
+    def __delitem__(self, index):
+        old = self[index] if isinstance(index, slice) else [self[index]]
+        list.__delitem__(self, index)
+        self._removed(old)
+
+    def __setslice__(self, i, j, items):
+        self.__setitem__(slice(max(0, i), max(0, j)), items)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(max(0, i), max(0, j)))
+
+    def move_before(self, anchor, items):
+        """ Moves items, in their given order, right before anchor in a single pass. """
+
+        moved = set(map(id, items))
+        order = []
+
+        for item in self:
+            if item is anchor:
+                order.extend(items)
+
+            if id(item) not in moved:
+                order.append(item)
+
+        list.__setslice__(self, 0, len(self), order)
+        self.reindex()
+
+class SBObjectList(IndexedList):
+    def reindex(self):
+        IndexedList.reindex(self)
+        self._types = None
+
+    def _added(self, items):
+        IndexedList._added(self, items)
+        self._types = None
+
+    def _removed(self, items):
+        IndexedList._removed(self, items)
+        self._types = None
+
+    def append(self, item):
+        types = self._types
+        IndexedList.append(self, item)
+
+        if types is not None:
+            types.setdefault(item.type, []).append(item)
+            self._types = types
+
+    def get_type(self, type):
+        if self._types is None:
+            self._types = {}
+
+            for item in self:
+                self._types.setdefault(item.type, []).append(item)
+
+        return self._types.get(type, [])
+
+class SBDataTable(object):
+    """ DIDX entries stored as parallel array columns, handing out SBDataEntry views. """
+
+    TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+    def __init__(self, raw=""):
+        entries = array(SBDataTable.TYPECODE, raw)
+
+        if sys.byteorder != "little":
+            entries.byteswap()
+
+        self.ids = entries[0::3]
+        self.offsets = entries[1::3]
+        self.sizes = entries[2::3]
+        self.origins = entries[1::3]
+        self.sources = [None] * len(self.ids)
+        self.map = None
+        self.base = None
+        self._order = None
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (SBDataEntry(self, i) for i in xrange(len(self.ids)))
+
+    def __getitem__(self, index):
+        return SBDataEntry(self, xrange(len(self.ids))[index])
+
+    def find(self, id):
+        if self._order is None:
+            self._order = sorted(xrange(len(self.ids)), key=self.ids.__getitem__)
+            self._sorted = [self.ids[i] for i in self._order]
+
+        i = bisect_left(self._sorted, id)
+
+        if i < len(self._sorted) and self._sorted[i] == id:
+            return self._order[i]
+
+        return None
+
+    def get(self, id, default=None):
+        i = self.find(id)
+
+        if i is None:
+            return default
+
+        return SBDataEntry(self, i)
+
+    def attach(self, source, offset):
+        """ Backs every payload not yet replaced by a zero-copy view into source (e.g. the mmap'd bank). """
+
+        self.map = source
+        self.base = offset
+
+    def replace(self, index, wem):
+        self.sizes[index] = wem.size
+        self.sources[index] = wem
+
+    def view(self, index):
+        if self.map is not None:
+            return buffer(self.map, self.base + self.origins[index], self.sizes[index])
+
+    def write(self, index, file):
+        if self.sources[index] is not None:
+            self.sources[index].write(file)
+        elif self.map is not None:
+            file.write_uchar(self.view(index))
+
+    def digest(self, index):
+        """ SHA1 of a payload, hashed in place. """
+
+        if self.sources[index] is not None:
+            return self.sources[index].digest()
+
+        return sha1(self.view(index) or "").digest()
+
+    def calculate_offsets(self, dedupe=False):
+        """ With dedupe, an entry whose payload was already laid out shares its offset. """
+
+        offsets = array(SBDataTable.TYPECODE)
+        layout = []
+        copies = {}
+        offset = 0
+
+        if dedupe:
+            counts = {}
+
+            for size in self.sizes:
+                counts[size] = counts.get(size, 0) + 1
+
+        for (i, size) in enumerate(self.sizes):
+            if dedupe and counts[size] > 1:
+                key = (size, self.digest(i))
+
+                if key in copies:
+                    offsets.append(copies[key])
+                    continue
+
+                copies[key] = offset
+
+            offsets.append(offset)
+            layout.append(i)
+            offset += size
+
+        self.offsets = offsets
+        self.layout = layout
+
+    def pack(self):
+        entries = array(SBDataTable.TYPECODE, [0]) * (len(self.ids) * 3)
+        entries[0::3] = self.ids
+        entries[1::3] = self.offsets
+        entries[2::3] = self.sizes
+
+        if sys.byteorder != "little":
+            entries.byteswap()
+
+        return entries.tostring()
+
+class SBDataEntry(object):
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def _get_id(self):
+        return self.table.ids[self.index]
+
+    def _set_id(self, id):
+        self.table.ids[self.index] = id
+        self.table._order = None
+
+    def _get_offset(self):
+        return self.table.offsets[self.index]
+
+    def _set_offset(self, offset):
+        self.table.offsets[self.index] = offset
+
+    def _get_size(self):
+        return self.table.sizes[self.index]
+
+    def _set_size(self, size):
+        self.table.sizes[self.index] = size
+
+    def _get_data(self):
+        source = self.table.sources[self.index]
+
+        if source is not None:
+            return source.data
+
+        view = self.table.view(self.index)
+
+        if view is not None:
+            return view[:]
+
+    id = property(_get_id, _set_id)
+    offset = property(_get_offset, _set_offset)
+    size = property(_get_size, _set_size)
+    data = property(_get_data)
+
+    def replace(self, wem):
+        self.table.replace(self.index, wem)
+
+    def write(self, file):
+        self.table.write(self.index, file)
+
 class SBHeader(SoundbankChunk):
     HEAD = "BKHD"
     #LENGTH = (0x10, 0x14, 0x18, 0x1C)
@@ -174,34 +592,40 @@ class SBDataIndex(SoundbankChunk):
             if (self.length % 12) != 0:
                 raise SBDataIndexError("Invalid length")
 
-            self.data_info = [WEM(data) for i in xrange(0, self.length, 12)]
+            self.offset = data.where()
+            raw = data.read_uchar(self.length)
+
+            if len(raw) != self.length:
+                raise SBDataIndexError("Invalid length")
+
+            self.data_info = SBDataTable(raw)
         else:
             self.head = SBDataIndex.HEAD
             self.length = None
-            self.data_info = []
+            self.offset = None
+            self.data_info = SBDataTable()
 
     def __nonzero__(self):
         return self.head is not None
 
     def get_total_size(self):
-        return sum(data.size for data in self.data_info)
+        # Deduplicated entries share one extent in DATA.
+        return sum(size for (offset, size) in set(zip(self.data_info.offsets, self.data_info.sizes)))
 
     def get_offset(self, id):
-        for data in self.data_info:
-            if data.id == id:
-                return data.offset
+        i = self.data_info.find(id)
+
+        if i is not None:
+            return self.data_info.offsets[i]
 
     def get_size(self, id):
-        for data in self.data_info:
-            if data.id == id:
-                return data.size
+        i = self.data_info.find(id)
 
-    def calculate_offsets(self):
-        offset = 0
+        if i is not None:
+            return self.data_info.sizes[i]
 
-        for data_info in self.data_info:
-            data_info.offset = offset
-            offset += data_info.size
+    def calculate_offsets(self, dedupe=False):
+        self.data_info.calculate_offsets(dedupe)
 
 class SBData(SoundbankChunk):
     HEAD = "DATA"
@@ -226,29 +650,102 @@ class SBData(SoundbankChunk):
             self.length = None
             self.offset = None
 
+        self.map = None
         self.data = []
 
     def __nonzero__(self):
         return self.head is not None
 
     def read_data(self, data, data_index):
-        for data_info in data_index.data_info:
-            data.goto(self.offset + data_info.offset)
-            data_info.data = data.read_uchar(data_info.size)
+        if data_index.data_info:
+            try:
+                self.map = data.map()
+            except (EnvironmentError, ValueError):
+                raise SBDataError("Could not map data")
+
+            data_index.data_info.attach(self.map, self.offset)
 
         data.goto(self.offset + self.length)
 
         self.data = data_index.data_info
 
+class Encodable(object):
+    """ Caches the encoded form until a field is reassigned; call invalidate() after in-place list changes. """
+
+    _encoded = None
+    _owner = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+
+        if name[0] != "_":
+            if isinstance(value, Encodable):
+                value.__dict__["_owner"] = self
+
+            if self._encoded is not None or self._owner is not None:
+                self.invalidate()
+
+    def invalidate(self):
+        self.__dict__["_encoded"] = None
+
+        if self._owner is not None:
+            self._owner.invalidate()
+
+    def encode(self):
+        return ""
+
+    def __str__(self):
+        if self._encoded is None:
+            self.__dict__["_encoded"] = self.encode()
+
+        return self._encoded
+
+    def __len__(self):
+        return len(str(self))
+
+class Record(object):
+    """ Fixed-width fields decoded and encoded with one precompiled struct. """
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self.names = tuple(name for (name, fmt) in fields)
+        self.bools = tuple(i for (i, (name, fmt)) in enumerate(fields) if fmt == "?")
+        self.unpacker = struct.Struct("<" + "".join("B" if fmt == "?" else fmt for (name, fmt) in fields))
+        self.packer = struct.Struct("<" + "".join(fmt for (name, fmt) in fields))
+        self.size = self.packer.size
+
+    def unpack(self, data):
+        values = data.read_struct(self.unpacker)
+
+        if self.bools:
+            values = list(values)
+
+            for i in self.bools:
+                if values[i] not in (0, 1):
+                    raise ValueError("Not a boolean")
+
+                values[i] = bool(values[i])
+
+        return values
+
+    def read(self, data, obj):
+        obj.__dict__.update(zip(self.names, self.unpack(data)))
+
+    def write(self, data, obj):
+        data.write_struct(self.packer, *[getattr(obj, name) for name in self.names])
+
+    def offset(self, name):
+        return struct.calcsize("<" + "".join(fmt for (field, fmt) in self.fields[:self.names.index(name)]))
+
 class SoundStructureField(object):
     pass
 
 class SoundStructure_Effect(SoundStructureField):
+    RECORD = Record(("index", "B"), ("id", "I"), ("unk_field16_1", "H"))
+
     def __init__(self, data=None):
         if data is not None:
-            self.index = data.read_uchar()
-            self.id = data.read_uint32()
-            self.unk_field16_1 = data.read_uint16()
+            SoundStructure_Effect.RECORD.read(data, self)
         else:
             self.index = None
             self.id = None
@@ -264,17 +761,14 @@ class SoundStructure_Additional(SoundStructureField):
             self.value = None
 
 class SoundStructure_StateGroup(SoundStructureField):
+    RECORD = Record(("id", "I"), ("change_occurs", "B"), ("different", "H"))
+
     def __init__(self, data=None):
         if data is not None:
-            self.id = data.read_uint32()
-            self.change_occurs = data.read_uchar()
-            self.different = data.read_uint16()
-            self.ids = []
-            self.ids_object_contain = []
-
-            for i in xrange(self.different):
-                self.ids.append(data.read_uint32)
-                self.ids_object_contain.append(data.read_uint32)
+            SoundStructure_StateGroup.RECORD.read(data, self)
+            ids = data.read_array("I", self.different * 2)
+            self.ids = ids[0::2]
+            self.ids_object_contain = ids[1::2]
         else:
             self.id = None
             self.change_occurs = None
@@ -283,22 +777,22 @@ class SoundStructure_StateGroup(SoundStructureField):
             self.ids_object_contain = []
 
 class SoundStructure_RTPC(SoundStructureField):
+    RECORD = Record(("x_axis_id", "I"), ("y_axis_type", "I"), ("unk_field32_1", "I"),
+                    ("unk_field8_1", "B"), ("points_count", "B"), ("unk_field8_2", "B"))
+    POINT = struct.Struct("<ffI")
+
     def __init__(self, data=None):
         if data is not None:
-            self.x_axis_id = data.read_uint32()
-            self.y_axis_type = data.read_uint32()
-            self.unk_field32_1 = data.read_uint32()
-            self.unk_field8_1 = data.read_uchar()
-            self.points_count = data.read_uchar()
-            self.unk_field8_2 = data.read_uchar()
+            SoundStructure_RTPC.RECORD.read(data, self)
             self.x_coordinates = []
             self.y_coordinates = []
             self.curve_shape = []
 
             for i in xrange(self.points_count):
-                self.x_coordinates.append(data.read_float())
-                self.y_coordinates.append(data.read_float())
-                self.curve_shape.append(data.read_uint32())
+                (x, y, curve_shape) = data.read_struct(SoundStructure_RTPC.POINT)
+                self.x_coordinates.append(x)
+                self.y_coordinates.append(y)
+                self.curve_shape.append(curve_shape)
         else:
             self.x_axis_id = None
             self.y_axis_type = None
@@ -310,22 +804,33 @@ class SoundStructure_RTPC(SoundStructureField):
             self.y_coordinates = []
             self.curve_shape = []
 
-class SoundStructure(object):
+class SoundStructure(Encodable):
+    EFFECTS = Record(("effects_override", "?"), ("effects_count", "B"))
+    BUSES = Record(("output_bus_id", "I"), ("parent_id", "I"), ("override_playback_priority", "?"),
+                   ("offset_priority", "?"), ("additional_parameters_count", "B"))
+    POSITIONING = Record(("unk_field8_1", "B"), ("has_positioning", "?"))
+    POSITIONING_3D = Record(("position_source", "I"), ("attenuation_id", "I"), ("enable_spatialization", "?"))
+    POSITIONING_PATH = Record(("play_type", "I"), ("do_loop", "?"), ("transition_time", "I"),
+                              ("follow_listener_orientation", "?"))
+    POSITIONING_UNKNOWN = Record(("unk_field32_1", "I"), ("unk_field32_2", "I"))
+    AUXILIARY = Record(("override_game_auxiliary_sends", "?"), ("use_game_auxiliary_sends", "?"),
+                       ("override_user_auxiliary_sends", "?"), ("user_auxiliary_sends_exists", "?"))
+    AUXILIARY_BUSES = Record(("auxiliary_bus_id0", "I"), ("auxiliary_bus_id1", "I"),
+                             ("auxiliary_bus_id2", "I"), ("auxiliary_bus_id3", "I"))
+    LIMIT = Record(("priority_equal", "B"), ("limit_reached", "B"), ("limit_sound_instances", "H"))
+    VOICE = Record(("how_to_limit_sound_instances", "B"), ("virtual_voice_behavior", "B"),
+                   ("override_playback_limit", "?"), ("override_virtual_voice", "?"), ("state_groups_count", "I"))
+
     def __init__(self, data=None):
         if data is not None:
-            self.effects_override = data.read_bool()
-            self.effects_count = data.read_uchar()
+            SoundStructure.EFFECTS.read(data, self)
             self.effects = []
 
             if self.effects_count > 0:
                 self.effects_bitmask = data.read_uchar()
                 self.effects = [SoundStructure_Effect(data) for i in xrange(self.effects_count)]
 
-            self.output_bus_id = data.read_uint32()
-            self.parent_id = data.read_uint32()
-            self.override_playback_priority = data.read_bool()
-            self.offset_priority = data.read_bool()
-            self.additional_parameters_count = data.read_uchar()
+            SoundStructure.BUSES.read(data, self)
             self.additional_parameters = []
 
             if self.additional_parameters_count > 0:
@@ -334,8 +839,7 @@ class SoundStructure(object):
                 for additional_parameter in self.additional_parameters:
                     additional_parameter.value = data.read_uint32() if additional_parameter.type == 0x07 else data.read_float()
 
-            self.unk_field8_1 = data.read_uchar()
-            self.has_positioning = data.read_bool()
+            SoundStructure.POSITIONING.read(data, self)
 
             if self.has_positioning:
                 self.positioning_type = data.read_uchar()
@@ -343,46 +847,28 @@ class SoundStructure(object):
                 if self.positioning_type == 0x2D:
                     self.enable_panner = data.read_bool()
                 elif self.positioning_type == 0x3D:
-                    self.position_source = data.read_uint32()
-                    self.attenuation_id = data.read_uint32()
-                    self.enable_spatialization = data.read_bool()
+                    SoundStructure.POSITIONING_3D.read(data, self)
 
                     if self.position_source == 0x02:
-                        self.play_type = data.read_uint32()
-                        self.do_loop = data.read_bool()
-                        self.transition_time = data.read_uint32()
-                        self.follow_listener_orientation = data.read_bool()
+                        SoundStructure.POSITIONING_PATH.read(data, self)
                     elif self.position_source == 0x03:
                         self.update_at_each_frame = data.read_bool()
                 elif self.positioning_type == 0x01:
                     self.unk_field16_1 = data.read_uint16()
                 else:
-                    self.unk_field32_1 = data.read_uint32()
-                    self.unk_field32_2 = data.read_uint32()
+                    SoundStructure.POSITIONING_UNKNOWN.read(data, self)
 
-            self.override_game_auxiliary_sends = data.read_bool()
-            self.use_game_auxiliary_sends = data.read_bool()
-            self.override_user_auxiliary_sends = data.read_bool()
-            self.user_auxiliary_sends_exists = data.read_bool()
+            SoundStructure.AUXILIARY.read(data, self)
 
             if self.user_auxiliary_sends_exists:
-                self.auxiliary_bus_id0 = data.read_uint32()
-                self.auxiliary_bus_id1 = data.read_uint32()
-                self.auxiliary_bus_id2 = data.read_uint32()
-                self.auxiliary_bus_id3 = data.read_uint32()
+                SoundStructure.AUXILIARY_BUSES.read(data, self)
 
             self.unk_field8_2 = data.read_bool()
 
             if self.unk_field8_2:
-                self.priority_equal = data.read_uchar()
-                self.limit_reached = data.read_uchar()
-                self.limit_sound_instances = data.read_uint16()
-
-            self.how_to_limit_sound_instances = data.read_uchar()
-            self.virtual_voice_behavior = data.read_uchar()
-            self.override_playback_limit = data.read_bool()
-            self.override_virtual_voice = data.read_bool()
-            self.state_groups_count = data.read_uint32()
+                SoundStructure.LIMIT.read(data, self)
+
+            SoundStructure.VOICE.read(data, self)
             self.state_groups = []
 
             if self.state_groups_count > 0:
@@ -448,26 +934,19 @@ class SoundStructure(object):
             self.unk_field32_3 = None
             self.unk_data = None
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
-        data.write_bool(self.effects_override)
-        data.write_uchar(self.effects_count)
+        SoundStructure.EFFECTS.write(data, self)
 
         if self.effects_count > 0:
             data.write_uchar(self.effects_bitmask)
 
             for effect in self.effects:
-                data.write_uchar(effect.index)
-                data.write_uint32(effect.id)
-                data.write_uint16(effect.unk_field16_1)
+                SoundStructure_Effect.RECORD.write(data, effect)
 
-        data.write_uint32(self.output_bus_id)
-        data.write_uint32(self.parent_id)
-        data.write_bool(self.override_playback_priority)
-        data.write_bool(self.offset_priority)
-        data.write_uchar(self.additional_parameters_count)
+        SoundStructure.BUSES.write(data, self)
 
         if self.additional_parameters_count > 0:
             for additional_parameter in self.additional_parameters:
@@ -479,8 +958,7 @@ class SoundStructure(object):
                 else:
                     data.write_float(additional_parameter.value)
 
-        data.write_uchar(self.unk_field8_1)
-        data.write_bool(self.has_positioning)
+        SoundStructure.POSITIONING.write(data, self)
 
         if self.has_positioning:
             data.write_uchar(self.positioning_type)
@@ -488,72 +966,44 @@ class SoundStructure(object):
             if self.positioning_type == 0x2D:
                 data.write_bool(self.enable_panner)
             elif self.positioning_type == 0x3D:
-                data.write_uint32(self.position_source)
-                data.write_uint32(self.attenuation_id)
-                data.write_bool(self.enable_spatialization)
+                SoundStructure.POSITIONING_3D.write(data, self)
 
                 if self.position_source == 0x02:
-                    data.write_uint32(self.play_type)
-                    data.write_bool(self.do_loop)
-                    data.write_uint32(self.transition_time)
-                    data.write_bool(self.follow_listener_orientation)
+                    SoundStructure.POSITIONING_PATH.write(data, self)
                 elif self.position_source == 0x03:
                     data.write_bool(self.update_at_each_frame)
             elif self.positioning_type == 0x01:
                 data.write_uint16(self.unk_field16_1)
             else:
-                data.write_uint32(self.unk_field32_1)
-                data.write_uint32(self.unk_field32_2)
+                SoundStructure.POSITIONING_UNKNOWN.write(data, self)
 
-        data.write_bool(self.override_game_auxiliary_sends)
-        data.write_bool(self.use_game_auxiliary_sends)
-        data.write_bool(self.override_user_auxiliary_sends)
-        data.write_bool(self.user_auxiliary_sends_exists)
+        SoundStructure.AUXILIARY.write(data, self)
 
         if self.user_auxiliary_sends_exists:
-            data.write_uint32(self.auxiliary_bus_id0)
-            data.write_uint32(self.auxiliary_bus_id1)
-            data.write_uint32(self.auxiliary_bus_id2)
-            data.write_uint32(self.auxiliary_bus_id3)
+            SoundStructure.AUXILIARY_BUSES.write(data, self)
 
         data.write_bool(self.unk_field8_2)
 
         if self.unk_field8_2:
-            data.write_uchar(self.priority_equal)
-            data.write_uchar(self.limit_reached)
-            data.write_uint16(self.limit_sound_instances)
+            SoundStructure.LIMIT.write(data, self)
 
-        data.write_uchar(self.how_to_limit_sound_instances)
-        data.write_uchar(self.virtual_voice_behavior)
-        data.write_bool(self.override_playback_limit)
-        data.write_bool(self.override_virtual_voice)
-        data.write_uint32(self.state_groups_count)
+        SoundStructure.VOICE.write(data, self)
 
         if self.state_groups_count > 0:
             for state_group in self.state_groups:
-                data.write_uint32(state_group.id)
-                data.write_uchar(state_group.change_occurs)
-                data.write_uint16(state_group.different)
+                SoundStructure_StateGroup.RECORD.write(data, state_group)
 
                 for i in xrange(state_group.different):
-                    data.write_uint32(state_group.ids[i])
-                    data.write_uint32(state_group.ids_object_contain[i])
+                    data.write_array("I", (state_group.ids[i], state_group.ids_object_contain[i]))
 
         data.write_uint16(self.rtpc_count)
 
         if self.rtpc_count > 0:
             for rtpc in self.rtpcs:
-                data.write_uint32(rtpc.x_axis_id)
-                data.write_uint32(rtpc.y_axis_type)
-                data.write_uint32(rtpc.unk_field32_1)
-                data.write_uchar(rtpc.unk_field8_1)
-                data.write_uchar(rtpc.points_count)
-                data.write_uchar(rtpc.unk_field8_2)
+                SoundStructure_RTPC.RECORD.write(data, rtpc)
 
                 for i in xrange(rtpc.points_count):
-                    data.write_float(rtpc.x_coordinates[i])
-                    data.write_float(rtpc.y_coordinates[i])
-                    data.write_uint32(rtpc.curve_shape[i])
+                    data.write_struct(SoundStructure_RTPC.POINT, rtpc.x_coordinates[i], rtpc.y_coordinates[i], rtpc.curve_shape[i])
 
         data.write_uint32(self.unk_field32_3)
 
@@ -562,14 +1012,8 @@ class SoundStructure(object):
 
         return buffer.getvalue()
 
-    def __len__(self):
-        return len(str(self))
-
-class SBObjectType(object):
-    def __str__(self):
-        return ""
-    def __len__(self):
-        return len(str(self))
+class SBObjectType(Encodable):
+    pass
 
 class SBSoundObject(SBObjectType):
     SOUND_EMBEDDED   = 0x00
@@ -577,21 +1021,20 @@ class SBSoundObject(SBObjectType):
     SOUND_PREFETCHED = 0x02
     SOUND_TYPE_SFX   = 0x00
     SOUND_TYPE_VOICE = 0x01
+    MEDIA_POS        = 0x14 # Offset/size fields of an embedded sound, counted from the object ID.
+
+    HEAD = Record(("unk_field32_1", "I"), ("include_type", "I"), ("audio_id", "I"), ("source_id", "I"))
+    MEDIA = Record(("offset", "I"), ("size", "I"))
 
     def __init__(self, data=None, curPos=None, length=None):
         if data is not None:
-            self.unk_field32_1 = data.read_uint32()
-            self.include_type = data.read_uint32()
+            SBSoundObject.HEAD.read(data, self)
 
             if self.include_type not in (SBSoundObject.SOUND_EMBEDDED, SBSoundObject.SOUND_STREAMED, SBSoundObject.SOUND_PREFETCHED):
                 raise SBObjectError("Invalid include type")
 
-            self.audio_id = data.read_uint32()
-            self.source_id = data.read_uint32()
-
             if self.include_type == SBSoundObject.SOUND_EMBEDDED:
-                self.offset = data.read_uint32()
-                self.size = data.read_uint32()
+                SBSoundObject.MEDIA.read(data, self)
 
             self.sound_type = data.read_uchar()
 
@@ -609,18 +1052,31 @@ class SBSoundObject(SBObjectType):
             self.sound_type = None
             self.sound_structure = None
 
-    def __str__(self):
+    @staticmethod
+    def peek_embedded(obj):
+        """ Returns (audio_id, offset, size) of an embedded sound, decoding nothing if possible. """
+
+        if obj.is_decoded():
+            if obj.obj.include_type != SBSoundObject.SOUND_EMBEDDED:
+                return None
+
+            return (obj.obj.audio_id, obj.obj.offset, obj.obj.size)
+
+        (include_type, audio_id) = obj.peek("<II", 8)
+
+        if include_type != SBSoundObject.SOUND_EMBEDDED:
+            return None
+
+        return (audio_id,) + obj.peek("<II", SBSoundObject.MEDIA_POS)
+
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
-        data.write_uint32(self.unk_field32_1)
-        data.write_uint32(self.include_type)
-        data.write_uint32(self.audio_id)
-        data.write_uint32(self.source_id)
+        SBSoundObject.HEAD.write(data, self)
 
         if self.include_type == SBSoundObject.SOUND_EMBEDDED:
-            data.write_uint32(self.offset)
-            data.write_uint32(self.size)
+            SBSoundObject.MEDIA.write(data, self)
 
         data.write_uchar(self.sound_type)
         data.write_uchar(str(self.sound_structure))
@@ -643,13 +1099,14 @@ class SBEventActionObject(SBObjectType):
     ACTION_TYPE_SET_STATE  = 0x12
     ACTION_TYPE_SET_SWITCH = 0x19
 
+    HEAD = Record(("scope", "B"), ("type", "B"), ("game_object_id", "I"), ("unk_field8_1", "B"),
+                  ("additional_parameters_count", "B"))
+    SET_STATE = Record(("state_group_id", "I"), ("state_id", "I"))
+    SET_SWITCH = Record(("switch_group_id", "I"), ("switch_id", "I"))
+
     def __init__(self, data=None, curPos=None, length=None):
         if data is not None:
-            self.scope = data.read_uchar()
-            self.type = data.read_uchar()
-            self.game_object_id = data.read_uint32()
-            self.unk_field8_1 = data.read_uchar()
-            self.additional_parameters_count = data.read_uchar()
+            SBEventActionObject.HEAD.read(data, self)
             self.additional_parameters = []
 
             if self.additional_parameters_count > 0:
@@ -661,11 +1118,9 @@ class SBEventActionObject(SBObjectType):
             self.unk_field8_2 = data.read_uchar()
 
             if self.type == SBEventActionObject.ACTION_TYPE_SET_STATE:
-                self.state_group_id = data.read_uint32()
-                self.state_id = data.read_uint32()
+                SBEventActionObject.SET_STATE.read(data, self)
             elif self.type == SBEventActionObject.ACTION_TYPE_SET_SWITCH:
-                self.switch_group_id = data.read_uint32()
-                self.switch_id = data.read_uint32()
+                SBEventActionObject.SET_SWITCH.read(data, self)
             #elif self.type == 0x01:
                 #self.unk_field32_1 = data.read_uint32()
                 #self.unk_field16_1 = data.read_uint16()
@@ -698,15 +1153,11 @@ class SBEventActionObject(SBObjectType):
             #self.unk_field8_3 = None
             self.unk_data = None
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
-        data.write_uchar(self.scope)
-        data.write_uchar(self.type)
-        data.write_uint32(self.game_object_id)
-        data.write_uchar(self.unk_field8_1)
-        data.write_uchar(self.additional_parameters_count)
+        SBEventActionObject.HEAD.write(data, self)
 
         for additional_parameter in self.additional_parameters:
             data.write_uchar(additional_parameter.type)
@@ -720,11 +1171,9 @@ class SBEventActionObject(SBObjectType):
         data.write_uchar(self.unk_field8_2)
 
         if self.type == SBEventActionObject.ACTION_TYPE_SET_STATE:
-            data.write_uint32(self.state_group_id)
-            data.write_uint32(self.state_id)
+            SBEventActionObject.SET_STATE.write(data, self)
         elif self.type == SBEventActionObject.ACTION_TYPE_SET_SWITCH:
-            data.write_uint32(self.switch_group_id)
-            data.write_uint32(self.switch_id)
+            SBEventActionObject.SET_SWITCH.write(data, self)
         #elif self.type == 0x01:
             #data.write_uint32(self.unk_field32_1)
             #data.write_uint16(self.unk_field16_1)
@@ -742,50 +1191,33 @@ class SBEventObject(SBObjectType):
     def __init__(self, data=None):
         if data is not None:
             self.event_actions = data.read_uint32()
-            self.event_action_ids = []
-
-            for i in xrange(self.event_actions):
-                self.event_action_ids.append(data.read_uint32())
+            self.event_action_ids = data.read_array("I", self.event_actions)
         else:
             self.event_actions = None
             self.event_action_ids = []
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
         data.write_uint32(self.event_actions)
-
-        for action_id in self.event_action_ids:
-            data.write_uint32(action_id)
+        data.write_array("I", self.event_action_ids)
 
         return buffer.getvalue()
 
 class SBMusicSegmentObject(SBObjectType):
+    TIMING = Record(("unk_double_1", "d"), ("unk_field64_1", "Q"), ("tempo", "f"), ("time_sig1", "B"),
+                    ("time_sig2", "B"), ("unk_field32_1", "I"), ("unk_field8_1", "B"), ("time_length", "d"),
+                    ("unk_field32_2", "I"), ("unk_field32_3", "I"), ("unk_field64_2", "Q"), ("unk_field32_4", "I"),
+                    ("unk_field32_5", "I"), ("time_length_next", "d"), ("unk_field32_6", "I"))
+
     def __init__(self, data=None, curPos=None, length=None):
         if data is not None:
             self.sound_structure = SoundStructure(data)
             self.children = data.read_uint32()
-            self.child_ids = []
-
-            for i in xrange(self.children):
-                self.child_ids.append(data.read_uint32())
+            self.child_ids = data.read_array("I", self.children)
 
-            self.unk_double_1 = data.read_double()
-            self.unk_field64_1 = data.read_uint64()
-            self.tempo = data.read_float()
-            self.time_sig1 = data.read_uchar()
-            self.time_sig2 = data.read_uchar()
-            self.unk_field32_1 = data.read_uint32()
-            self.unk_field8_1 = data.read_uchar()
-            self.time_length = data.read_double()
-            self.unk_field32_2 = data.read_uint32()
-            self.unk_field32_3 = data.read_uint32()
-            self.unk_field64_2 = data.read_uint64()
-            self.unk_field32_4 = data.read_uint32()
-            self.unk_field32_5 = data.read_uint32()
-            self.time_length_next = data.read_double()
-            self.unk_field32_6 = data.read_uint32()
+            SBMusicSegmentObject.TIMING.read(data, self)
 
             remaining = (length - (data.where() - curPos))
 
@@ -813,31 +1245,15 @@ class SBMusicSegmentObject(SBObjectType):
             self.time_length_next = None
             self.unk_field32_6 = None
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
         data.write_uchar(str(self.sound_structure))
         data.write_uint32(self.children)
+        data.write_array("I", self.child_ids)
 
-        for child in self.child_ids:
-            data.write_uint32(child)
-
-        data.write_double(self.unk_double_1)
-        data.write_uint64(self.unk_field64_1)
-        data.write_float(self.tempo)
-        data.write_uchar(self.time_sig1)
-        data.write_uchar(self.time_sig2)
-        data.write_uint32(self.unk_field32_1)
-        data.write_uchar(self.unk_field8_1)
-        data.write_double(self.time_length)
-        data.write_uint32(self.unk_field32_2)
-        data.write_uint32(self.unk_field32_3)
-        data.write_uint64(self.unk_field64_2)
-        data.write_uint32(self.unk_field32_4)
-        data.write_uint32(self.unk_field32_5)
-        data.write_double(self.time_length_next)
-        data.write_uint32(self.unk_field32_6)
+        SBMusicSegmentObject.TIMING.write(data, self)
 
         if self.unk_data is not None:
             data.write_uchar(self.unk_data)
@@ -845,23 +1261,17 @@ class SBMusicSegmentObject(SBObjectType):
         return buffer.getvalue()
 
 class SBMusicTrackObject(SBObjectType):
+    HEAD = Record(("unk_field32_1", "I"), ("unk_field32_2", "I"), ("unk_field32_3", "I"), ("id1", "I"))
+    SOURCE = Record(("id2", "I"), ("unk_field32_4", "I"), ("unk_field32_5", "I"), ("unk_field8_1", "B"),
+                    ("id3", "I"), ("unk_field64_1", "Q"), ("unk_field64_2", "Q"), ("unk_field64_3", "Q"),
+                    ("time_length", "d"))
+
     def __init__(self, data=None, curPos=None, length=None):
         if data is not None:
-            self.unk_field32_1 = data.read_uint32()
-            self.unk_field32_2 = data.read_uint32()
-            self.unk_field32_3 = data.read_uint32()
-            self.id1 = data.read_uint32()
+            SBMusicTrackObject.HEAD.read(data, self)
 
             if self.id1 > 0:
-                self.id2 = data.read_uint32()
-                self.unk_field32_4 = data.read_uint32()
-                self.unk_field32_5 = data.read_uint32()
-                self.unk_field8_1 = data.read_uchar()
-                self.id3 = data.read_uint32()
-                self.unk_field64_1 = data.read_uint64()
-                self.unk_field64_2 = data.read_uint64()
-                self.unk_field64_3 = data.read_uint64()
-                self.time_length = data.read_double()
+                SBMusicTrackObject.SOURCE.read(data, self)
 
             remaining = (length - (data.where() - curPos))
 
@@ -882,31 +1292,24 @@ class SBMusicTrackObject(SBObjectType):
             self.time_length = None
             self.unk_data = None
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
-        data.write_uint32(self.unk_field32_1)
-        data.write_uint32(self.unk_field32_2)
-        data.write_uint32(self.unk_field32_3)
-        data.write_uint32(self.id1)
+        SBMusicTrackObject.HEAD.write(data, self)
 
         if self.id1 > 0:
-            data.write_uint32(self.id2)
-            data.write_uint32(self.unk_field32_4)
-            data.write_uint32(self.unk_field32_5)
-            data.write_uchar(self.unk_field8_1)
-            data.write_uint32(self.id3)
-            data.write_uint64(self.unk_field64_1)
-            data.write_uint64(self.unk_field64_2)
-            data.write_uint64(self.unk_field64_3)
-            data.write_double(self.time_length)
+            SBMusicTrackObject.SOURCE.write(data, self)
 
         data.write_uchar(self.unk_data)
 
         return buffer.getvalue()
 
 class SBMusicTrackCustomObject(SBMusicTrackObject):
+    TAIL = Record(("unk_field32_6", "I"), ("unk_field64_4", "Q"), ("unk_field16_1", "H"), ("parent", "I"),
+                  ("unk_field64_5", "Q"), ("unk_field8_2", "B"), ("unk_field32_7", "I"), ("unk_field64_6", "Q"),
+                  ("unk_field64_7", "Q"), ("unk_field16_2", "H"), ("unk_field8_3", "B"), ("unk_field32_8", "I"))
+
     def __init__(self, mid, new_time, parent):
         self.unk_field32_1 = 1
         self.unk_field32_2 = 0x00040001
@@ -934,35 +1337,13 @@ class SBMusicTrackCustomObject(SBMusicTrackObject):
         self.unk_field8_3 = 0
         self.unk_field32_8 = 0x00000064
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
-        data.write_uint32(self.unk_field32_1)
-        data.write_uint32(self.unk_field32_2)
-        data.write_uint32(self.unk_field32_3)
-        data.write_uint32(self.id1)
-        data.write_uint32(self.id2)
-        data.write_uint32(self.unk_field32_4)
-        data.write_uint32(self.unk_field32_5)
-        data.write_uchar(self.unk_field8_1)
-        data.write_uint32(self.id3)
-        data.write_uint64(self.unk_field64_1)
-        data.write_uint64(self.unk_field64_2)
-        data.write_uint64(self.unk_field64_3)
-        data.write_double(self.time_length)
-        data.write_uint32(self.unk_field32_6)
-        data.write_uint64(self.unk_field64_4)
-        data.write_uint16(self.unk_field16_1)
-        data.write_uint32(self.parent)
-        data.write_uint64(self.unk_field64_5)
-        data.write_uchar(self.unk_field8_2)
-        data.write_uint32(self.unk_field32_7)
-        data.write_uint64(self.unk_field64_6)
-        data.write_uint64(self.unk_field64_7)
-        data.write_uint16(self.unk_field16_2)
-        data.write_uchar(self.unk_field8_3)
-        data.write_uint32(self.unk_field32_8)
+        SBMusicTrackObject.HEAD.write(data, self)
+        SBMusicTrackObject.SOURCE.write(data, self)
+        SBMusicTrackCustomObject.TAIL.write(data, self)
 
         return buffer.getvalue()
 
@@ -970,36 +1351,18 @@ class MusicSwitchObject(object):
     pass
 
 class MusicSwitchObject_Transition(MusicSwitchObject):
+    RECORD = Record(("source_id", "I"), ("dest_id", "I"), ("source_fadeout", "i"), ("source_shape_curve_fadeout", "I"),
+                    ("source_fadeout_offset", "i"), ("exit_source", "I"), ("unk_field32_1", "I"), ("unk_field32_2", "I"),
+                    ("src_type", "B"), ("dest_fadein", "i"), ("dest_shape_curve_fadein", "I"), ("dest_fadein_offset", "i"),
+                    ("match_custom_cue_id", "I"), ("playlist_id", "I"), ("sync_to", "H"), ("dest_type", "B"),
+                    ("unk_field8_1", "B"), ("has_transition", "?"), ("trans_id", "I"), ("trans_fadein", "i"),
+                    ("trans_shape_curve_fadein", "I"), ("trans_fadein_offset", "i"), ("trans_fadeout", "i"),
+                    ("trans_shape_curve_fadeout", "I"), ("trans_fadeout_offset", "i"), ("trans_fadein_type", "B"),
+                    ("trans_fadeout_type", "B"))
+
     def __init__(self, data=None):
         if data is not None:
-            self.source_id = data.read_uint32()
-            self.dest_id = data.read_uint32()
-            self.source_fadeout = data.read_int32()
-            self.source_shape_curve_fadeout = data.read_uint32()
-            self.source_fadeout_offset = data.read_int32()
-            self.exit_source = data.read_uint32()
-            self.unk_field32_1 = data.read_uint32()
-            self.unk_field32_2 = data.read_uint32()
-            self.src_type = data.read_uchar()
-            self.dest_fadein = data.read_int32()
-            self.dest_shape_curve_fadein = data.read_uint32()
-            self.dest_fadein_offset = data.read_int32()
-            self.match_custom_cue_id = data.read_uint32()
-            self.playlist_id = data.read_uint32()
-            self.sync_to = data.read_uint16()
-            self.dest_type = data.read_uchar()
-            self.unk_field8_1 = data.read_uchar()
-            self.has_transition = data.read_bool()
-            self.trans_id = data.read_uint32()
-            self.trans_fadein = data.read_int32()
-            self.trans_shape_curve_fadein = data.read_uint32()
-            self.trans_fadein_offset = data.read_int32()
-            self.trans_fadeout = data.read_int32()
-            self.trans_shape_curve_fadeout = data.read_uint32()
-            self.trans_fadeout_offset = data.read_int32()
-            self.trans_fadein_type = data.read_uchar()
-            self.trans_fadeout_type = data.read_uchar()
-
+            MusicSwitchObject_Transition.RECORD.read(data, self)
         else:
             self.source_id = None
             self.dest_id = None
@@ -1030,32 +1393,26 @@ class MusicSwitchObject_Transition(MusicSwitchObject):
             self.trans_fadeout_type = None
 
 class MusicSwitchObject_SwitchState(MusicSwitchObject):
+    RECORD = Record(("id", "I"), ("music_id", "I"))
+
     def __init__(self, data=None):
         if data is not None:
-            self.id = data.read_uint32()
-            self.music_id = data.read_uint32()
+            MusicSwitchObject_SwitchState.RECORD.read(data, self)
         else:
             self.id = None
             self.music_id = None
 
 class SBMusicSwitchObject(SBObjectType):
+    TIMING = Record(("unk_double_1", "d"), ("unk_field64_1", "Q"), ("tempo", "f"), ("time_sig1", "B"),
+                    ("time_sig2", "B"), ("unk_field8_1", "B"), ("unk_field32_3", "I"), ("transition_count", "I"))
+
     def __init__(self, data=None, curPos=None, length=None):
         if data is not None:
             self.sound_structure = SoundStructure(data)
             self.children = data.read_uint32()
-            self.child_ids = []
-
-            for i in xrange(self.children):
-                self.child_ids.append(data.read_uint32())
+            self.child_ids = data.read_array("I", self.children)
 
-            self.unk_double_1 = data.read_double()
-            self.unk_field64_1 = data.read_uint64()
-            self.tempo = data.read_float()
-            self.time_sig1 = data.read_uchar()
-            self.time_sig2 = data.read_uchar()
-            self.unk_field8_1 = data.read_uchar()
-            self.unk_field32_3 = data.read_uint32()
-            self.transition_count = data.read_uint32()
+            SBMusicSwitchObject.TIMING.read(data, self)
             self.transitions = []
 
             #if self.transition_count > 0:
@@ -1077,35 +1434,18 @@ class MusicPlaylistObject(object):
     pass
 
 class MusicPlaylistObject_Transition(MusicPlaylistObject):
+    RECORD = Record(("source_id", "I"), ("dest_id", "I"), ("source_fadeout", "i"), ("source_shape_curve_fadeout", "I"),
+                    ("source_fadeout_offset", "i"), ("unk_field32_1", "I"), ("unk_field32_2", "I"), ("unk_field32_3", "I"),
+                    ("src_type", "B"), ("dest_fadein", "i"), ("dest_shape_curve_fadein", "I"), ("dest_fadein_offset", "i"),
+                    ("unk_field32_4", "I"), ("unk_field32_5", "I"), ("unk_field16_1", "H"), ("dest_type", "B"),
+                    ("unk_field8_1", "B"), ("has_segment", "?"), ("trans_segment_id", "I"), ("trans_fadein", "i"),
+                    ("trans_shape_curve_fadein", "I"), ("trans_fadein_offset", "i"), ("trans_fadeout", "i"),
+                    ("trans_shape_curve_fadeout", "I"), ("trans_fadeout_offset", "i"), ("trans_fadein_type", "B"),
+                    ("trans_fadeout_type", "B"))
+
     def __init__(self, data=None):
         if data is not None:
-            self.source_id = data.read_uint32()
-            self.dest_id = data.read_uint32()
-            self.source_fadeout = data.read_int32()
-            self.source_shape_curve_fadeout = data.read_uint32()
-            self.source_fadeout_offset = data.read_int32()
-            self.unk_field32_1 = data.read_uint32()
-            self.unk_field32_2 = data.read_uint32()
-            self.unk_field32_3 = data.read_uint32()
-            self.src_type = data.read_uchar()
-            self.dest_fadein = data.read_int32()
-            self.dest_shape_curve_fadein = data.read_uint32()
-            self.dest_fadein_offset = data.read_int32()
-            self.unk_field32_4 = data.read_uint32()
-            self.unk_field32_5 = data.read_uint32()
-            self.unk_field16_1 = data.read_uint16()
-            self.dest_type = data.read_uchar()
-            self.unk_field8_1 = data.read_uchar()
-            self.has_segment = data.read_bool()
-            self.trans_segment_id = data.read_uint32()
-            self.trans_fadein = data.read_int32()
-            self.trans_shape_curve_fadein = data.read_uint32()
-            self.trans_fadein_offset = data.read_int32()
-            self.trans_fadeout = data.read_int32()
-            self.trans_shape_curve_fadeout = data.read_uint32()
-            self.trans_fadeout_offset = data.read_int32()
-            self.trans_fadein_type = data.read_uchar()
-            self.trans_fadeout_type = data.read_uchar()
+            MusicPlaylistObject_Transition.RECORD.read(data, self)
         else:
             self.source_id = None
             self.dest_id = None
@@ -1136,19 +1476,14 @@ class MusicPlaylistObject_Transition(MusicPlaylistObject):
             self.trans_fadeout_type = None
 
 class MusicPlaylistObject_PlaylistElement(MusicPlaylistObject):
-    SIZE = 0x1A
+    RECORD = Record(("music_segment_id", "I"), ("id", "I"), ("child_elements", "I"), ("playlist_type", "i"),
+                    ("loop_count", "H"), ("weight", "I"), ("times_in_row", "H"), ("unk_field8_1", "B"),
+                    ("random_type", "B"))
+    SIZE = RECORD.size
 
     def __init__(self, data=None):
         if data is not None:
-            self.music_segment_id = data.read_uint32()
-            self.id = data.read_uint32()
-            self.child_elements = data.read_uint32()
-            self.playlist_type = data.read_int32()
-            self.loop_count = data.read_uint16()
-            self.weight = data.read_uint32()
-            self.times_in_row = data.read_uint16()
-            self.unk_field8_1 = data.read_uchar()
-            self.random_type = data.read_uchar()
+            MusicPlaylistObject_PlaylistElement.RECORD.read(data, self)
         else:
             self.music_segment_id = None
             self.id = None
@@ -1161,23 +1496,16 @@ class MusicPlaylistObject_PlaylistElement(MusicPlaylistObject):
             self.random_type = None
 
 class SBMusicPlaylistObject(SBObjectType):
+    TIMING = Record(("unk_double_1", "d"), ("unk_field64_1", "Q"), ("tempo", "f"), ("time_sig1", "B"),
+                    ("time_sig2", "B"), ("unk_field8_1", "B"), ("unk_field32_1", "I"), ("transition_count", "I"))
+
     def __init__(self, data=None, curPos=None, length=None):
         if data is not None:
             self.sound_structure = SoundStructure(data)
             self.segments = data.read_uint32()
-            self.segment_ids = []
+            self.segment_ids = data.read_array("I", self.segments)
 
-            for i in xrange(self.segments):
-                self.segment_ids.append(data.read_uint32())
-
-            self.unk_double_1 = data.read_double()
-            self.unk_field64_1 = data.read_uint64()
-            self.tempo = data.read_float()
-            self.time_sig1 = data.read_uchar()
-            self.time_sig2 = data.read_uchar()
-            self.unk_field8_1 = data.read_uchar()
-            self.unk_field32_1 = data.read_uint32()
-            self.transition_count = data.read_uint32()
+            SBMusicPlaylistObject.TIMING.read(data, self)
             self.transitions = []
 
             if self.transition_count > 0:
@@ -1206,66 +1534,23 @@ class SBMusicPlaylistObject(SBObjectType):
             self.playlist_elements_count = None
             self.playlist_elements = []
 
-    def __str__(self):
+    def encode(self):
         buffer = StringIO()
         data = FileWrite(buffer, True)
 
         data.write_uchar(str(self.sound_structure))
         data.write_uint32(self.segments)
+        data.write_array("I", self.segment_ids)
 
-        for segment in self.segment_ids:
-            data.write_uint32(segment)
-
-        data.write_double(self.unk_double_1)
-        data.write_uint64(self.unk_field64_1)
-        data.write_float(self.tempo)
-        data.write_uchar(self.time_sig1)
-        data.write_uchar(self.time_sig2)
-        data.write_uchar(self.unk_field8_1)
-        data.write_uint32(self.unk_field32_1)
-        data.write_uint32(self.transition_count)
+        SBMusicPlaylistObject.TIMING.write(data, self)
 
         for transition in self.transitions:
-            data.write_uint32(transition.source_id)
-            data.write_uint32(transition.dest_id)
-            data.write_int32(transition.source_fadeout)
-            data.write_uint32(transition.source_shape_curve_fadeout)
-            data.write_int32(transition.source_fadeout_offset)
-            data.write_uint32(transition.unk_field32_1)
-            data.write_uint32(transition.unk_field32_2)
-            data.write_uint32(transition.unk_field32_3)
-            data.write_uchar(transition.src_type)
-            data.write_int32(transition.dest_fadein)
-            data.write_uint32(transition.dest_shape_curve_fadein)
-            data.write_int32(transition.dest_fadein_offset)
-            data.write_uint32(transition.unk_field32_4)
-            data.write_uint32(transition.unk_field32_5)
-            data.write_uint16(transition.unk_field16_1)
-            data.write_uchar(transition.dest_type)
-            data.write_uchar(transition.unk_field8_1)
-            data.write_bool(transition.has_segment)
-            data.write_uint32(transition.trans_segment_id)
-            data.write_int32(transition.trans_fadein)
-            data.write_uint32(transition.trans_shape_curve_fadein)
-            data.write_int32(transition.trans_fadein_offset)
-            data.write_int32(transition.trans_fadeout)
-            data.write_uint32(transition.trans_shape_curve_fadeout)
-            data.write_int32(transition.trans_fadeout_offset)
-            data.write_uchar(transition.trans_fadein_type)
-            data.write_uchar(transition.trans_fadeout_type)
+            MusicPlaylistObject_Transition.RECORD.write(data, transition)
 
         data.write_uint32(self.playlist_elements_count)
 
         for playlist_element in self.playlist_elements:
-            data.write_uint32(playlist_element.music_segment_id)
-            data.write_uint32(playlist_element.id)
-            data.write_uint32(playlist_element.child_elements)
-            data.write_int32(playlist_element.playlist_type)
-            data.write_uint16(playlist_element.loop_count)
-            data.write_uint32(playlist_element.weight)
-            data.write_uint16(playlist_element.times_in_row)
-            data.write_uchar(playlist_element.unk_field8_1)
-            data.write_uchar(playlist_element.random_type)
+            MusicPlaylistObject_PlaylistElement.RECORD.write(data, playlist_element)
 
         return buffer.getvalue()
 
@@ -1325,11 +1610,11 @@ class SBMusicPlaylistObject(SBObjectType):
             ini.add_section("PLAYLIST ELEMENT %i" % (i))
 
             tracks = []
+            obj = objects.get(playlist_element.music_segment_id)
 
-            for obj in objects:
-                if obj.type == SBObject.TYPE_MUSIC_SEGMENT and obj.id == playlist_element.music_segment_id:
-                    tracks = [str(child.obj.id1) for child in objects if child.id in obj.obj.child_ids]
-                    break
+            if obj is not None and obj.type == SBObject.TYPE_MUSIC_SEGMENT:
+                child_ids = set(obj.obj.child_ids)
+                tracks = [str(child.obj.id1) for child in objects.get_type(SBObject.TYPE_MUSIC_TRACK) if child.id in child_ids]
 
             if tracks:
                 ini.set("PLAYLIST ELEMENT %i" % (i), "tracks", ", ".join(tracks))
@@ -1446,50 +1731,310 @@ class SBMusicPlaylistObject(SBObjectType):
 
         return moveSegments
 
-class SBObject(object):
-    TYPE_SOUND          = 0x02
-    TYPE_EVENT_ACTION   = 0x03
-    TYPE_EVENT          = 0x04
-    TYPE_MUSIC_SEGMENT  = 0x0A
-    TYPE_MUSIC_TRACK    = 0x0B
-    TYPE_MUSIC_SWITCH   = 0x0C
-    TYPE_MUSIC_PLAYLIST = 0x0D
+    def export_json(self, tracks):
+        """ Returns the playlist as a JSON-ready dict, tracks mapping segment IDs to their WEM IDs. """
 
-    def __init__(self, data=None):
-        if data is not None:
-            self.type = data.read_uchar()
-            self.length = data.read_uint32()
-            curPos = data.where()
-            self.id = data.read_uint32()
+        transition_fields = MusicPlaylistObject_Transition.RECORD.names
+        element_fields = MusicPlaylistObject_PlaylistElement.RECORD.names
 
-            if self.type == SBObject.TYPE_SOUND:
-                self.obj = SBSoundObject(data, curPos, self.length)
-            elif self.type == SBObject.TYPE_EVENT_ACTION:
-                self.obj = SBEventActionObject(data, curPos, self.length)
-            elif self.type == SBObject.TYPE_EVENT:
-                self.obj = SBEventObject(data)
-            elif self.type == SBObject.TYPE_MUSIC_SEGMENT:
-                self.obj = SBMusicSegmentObject(data, curPos, self.length)
-            elif self.type == SBObject.TYPE_MUSIC_TRACK:
-                self.obj = SBMusicTrackObject(data, curPos, self.length)
-            #elif self.type == SBObject.TYPE_MUSIC_SWITCH:
-                #self.obj = SBMusicSwitchObject(data, curPos, self.length)
-            elif self.type == SBObject.TYPE_MUSIC_PLAYLIST:
-                self.obj = SBMusicPlaylistObject(data, curPos, self.length)
-            else:
-                self.obj = data.read_uchar(self.length - 4)
+        playlist = OrderedDict()
+        playlist["segments"] = list(self.segment_ids)
+        playlist["transitions"] = [OrderedDict((name, getattr(transition, name)) for name in transition_fields)
+                                   for transition in self.transitions]
+        playlist["playlist_elements"] = []
 
-            if (data.where() - curPos) != self.length:
-                raise SBObjectError("Invalid object")
-        else:
+        for playlist_element in self.playlist_elements:
+            element = OrderedDict()
+
+            if tracks.get(playlist_element.music_segment_id):
+                element["tracks"] = tracks[playlist_element.music_segment_id]
+
+            element.update((name, getattr(playlist_element, name)) for name in element_fields)
+            playlist["playlist_elements"].append(element)
+
+        return playlist
+
+    def reimport_json(self, playlist):
+        """ Same as reimport, from a dict made by export_json. Returns the segments to move. """
+
+        new_transitions = []
+        new_playlist_elements = []
+
+        try:
+            new_segment_ids = [int(segid) for segid in playlist.get("segments", ())]
+            moveSegments = [int(segid) for segid in playlist.get("move_segments", ())]
+
+            for transition in playlist.get("transitions", ()):
+                new_transition = MusicPlaylistObject_Transition()
+
+                for name in MusicPlaylistObject_Transition.RECORD.names:
+                    setattr(new_transition, name, bool(transition[name]) if name == "has_segment" else int(transition[name]))
+
+                new_transitions.append(new_transition)
+
+            for playlist_element in playlist.get("playlist_elements", ()):
+                new_playlist_element = MusicPlaylistObject_PlaylistElement()
+
+                for name in MusicPlaylistObject_PlaylistElement.RECORD.names:
+                    if name == "id" and playlist_element[name] == "<NEW ID>":
+                        new_playlist_element.id = self._get_new_element_id()
+                    else:
+                        setattr(new_playlist_element, name, int(playlist_element[name]))
+
+                new_playlist_elements.append(new_playlist_element)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise SBObjectError("Invalid playlist")
+
+        if new_segment_ids:
+            self.segment_ids = new_segment_ids
+            self.segments = len(self.segment_ids)
+
+        if new_transitions:
+            self.transitions = new_transitions
+            self.transition_count = len(self.transitions)
+
+        if new_playlist_elements:
+            self.playlist_elements = new_playlist_elements
+
+        return moveSegments
+
+class SBObject(object):
+    TYPE_SOUND          = 0x02
+    TYPE_EVENT_ACTION   = 0x03
+    TYPE_EVENT          = 0x04
+    TYPE_MUSIC_SEGMENT  = 0x0A
+    TYPE_MUSIC_TRACK    = 0x0B
+    TYPE_MUSIC_SWITCH   = 0x0C
+    TYPE_MUSIC_PLAYLIST = 0x0D
+
+    TYPE_NAMES = {TYPE_SOUND: "SOUND", TYPE_EVENT_ACTION: "EVENT ACTION", TYPE_EVENT: "EVENT",
+                  TYPE_MUSIC_SEGMENT: "MUSIC SEGMENT", TYPE_MUSIC_TRACK: "MUSIC TRACK",
+                  TYPE_MUSIC_SWITCH: "MUSIC SWITCH", TYPE_MUSIC_PLAYLIST: "MUSIC PLAYLIST"}
+
+    def __init__(self, data=None):
+        self._obj = None
+        self._raw = None
+
+        if data is not None:
+            self.type = data.read_uchar()
+            self.length = data.read_uint32()
+            self.offset = data.where()
+            self.id = data.read_uint32()
+
+            data.goto(self.offset)
+            self._raw = data.read_view(self.length)
+
+            if len(self._raw) != self.length:
+                raise SBObjectError("Invalid object")
+        else:
             self.type = None
             self.length = None
+            self.offset = None
             self.id = None
-            self.obj = None
+
+    @staticmethod
+    def from_raw(type, id, offset, raw):
+        """ Returns an undecoded object over raw, its body starting with the ID. """
+
+        obj = SBObject.__new__(SBObject)
+        obj.__dict__.update(type=type, length=len(raw), offset=offset, id=id, _obj=None, _raw=raw)
+
+        return obj
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        if state["_raw"] is not None:
+            state["_raw"] = str(state["_raw"])
+
+        return state
+
+    def _decode(self):
+        data = FileRead(StringIO(self._raw), True)
+        curPos = data.where()
+        data.read_uint32()
+
+        if self.type == SBObject.TYPE_SOUND:
+            obj = SBSoundObject(data, curPos, self.length)
+        elif self.type == SBObject.TYPE_EVENT_ACTION:
+            obj = SBEventActionObject(data, curPos, self.length)
+        elif self.type == SBObject.TYPE_EVENT:
+            obj = SBEventObject(data)
+        elif self.type == SBObject.TYPE_MUSIC_SEGMENT:
+            obj = SBMusicSegmentObject(data, curPos, self.length)
+        elif self.type == SBObject.TYPE_MUSIC_TRACK:
+            obj = SBMusicTrackObject(data, curPos, self.length)
+        #elif self.type == SBObject.TYPE_MUSIC_SWITCH:
+            #obj = SBMusicSwitchObject(data, curPos, self.length)
+        elif self.type == SBObject.TYPE_MUSIC_PLAYLIST:
+            obj = SBMusicPlaylistObject(data, curPos, self.length)
+        else:
+            obj = data.read_uchar(self.length - 4)
+
+        if (data.where() - curPos) != self.length:
+            raise SBObjectError("Invalid object")
+
+        if isinstance(obj, Encodable):
+            obj.__dict__["_encoded"] = self._raw[4:]
+
+        return obj
+
+    @staticmethod
+    def type_name(type):
+        return SBObject.TYPE_NAMES.get(type) or "TYPE 0x%02X" % (type)
+
+    def _get_obj(self):
+        if self._raw is not None:
+            if Profile.enabled:
+                start = Profile.clock()
+                self._obj = self._decode()
+                Profile.add("Decode " + SBObject.type_name(self.type), Profile.clock() - start, self.length, 1)
+            else:
+                self._obj = self._decode()
+
+            self._raw = None
+
+        return self._obj
+
+    def _set_obj(self, obj):
+        self._obj = obj
+        self._raw = None
+
+    obj = property(_get_obj, _set_obj)
+
+    def is_decoded(self):
+        return self._raw is None
+
+    def set_raw(self, raw):
+        """ Replaces the body (id included) by raw, decoded again on first access. """
+
+        self._obj = None
+        self._raw = raw
+        self.length = len(raw)
+
+    def peek(self, fmt, offset):
+        """ Unpacks fields from the body (id included) without decoding the object. """
+
+        return struct.unpack_from(fmt, self._raw, offset)
 
     def calculate_length(self):
         self.length = 4 + len(self.obj)
 
+    def reencode(self):
+        """ Decodes the object and encodes it again from its fields, returns whether the body is unchanged. """
+
+        raw = self._raw
+        obj = self.obj
+
+        if raw is None or not isinstance(obj, Encodable):
+            return True
+
+        obj.invalidate()
+
+        return str(obj) == raw[4:]
+
+    HEADER = struct.Struct("<BII")
+
+    def write(self, file):
+        if self._raw is not None:
+            body = buffer(self._raw, 4)
+        else:
+            body = str(self._obj)
+
+        self.length = 4 + len(body)
+
+        file.write_struct(SBObject.HEADER, self.type, self.length, self.id)
+        file.write_uchar(body)
+
+class SBObjectIDs(object):
+    """ Sorted, mmap'd view of the ids in objectids.db, sorted once into a sidecar keyed by its hash. """
+
+    PATH = "objectids.db"
+    SORTED_EXT = ".idx"
+    ID = struct.Struct("<I")
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self._file = None
+        self._map = None
+
+        try:
+            with open(path, "rb") as f:
+                hash = f.read(sha1().digestsize)
+        except (OSError, IOError):
+            raise SBObjectsError("Could not read object ids database")
+
+        if not self._open(hash):
+            self._build(hash)
+
+    def _open(self, hash):
+        try:
+            file = open(self.path + SBObjectIDs.SORTED_EXT, "rb")
+        except (OSError, IOError):
+            return False
+
+        size = os.path.getsize(file.name)
+
+        if size < len(hash) or (size - len(hash)) % SBObjectIDs.ID.size != 0 or file.read(len(hash)) != hash:
+            file.close()
+            return False
+
+        self._file = file
+        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size > len(hash) else ""
+        self._base = len(hash)
+        self._count = (size - len(hash)) / SBObjectIDs.ID.size
+
+        return True
+
+    def _build(self, hash):
+        with open(self.path, "rb") as f:
+            f.seek(len(hash))
+            data = f.read()
+
+        if sha1(data).digest() != hash or len(data) % SBObjectIDs.ID.size != 0:
+            raise SBObjectsError("Invalid object ids database")
+
+        ids = array(SBDataTable.TYPECODE, data)
+
+        if sys.byteorder != "little":
+            ids.byteswap()
+
+        ids = array(SBDataTable.TYPECODE, sorted(set(ids)))
+
+        if sys.byteorder != "little":
+            ids.byteswap()
+
+        data = ids.tostring()
+
+        try:
+            with open(self.path + SBObjectIDs.SORTED_EXT, "wb") as f:
+                f.write(hash)
+                f.write(data)
+        except (OSError, IOError):
+            # Read only folder, keep the sorted ids in memory.
+            pass
+        else:
+            if self._open(hash):
+                return
+
+        self._map = data
+        self._base = 0
+        self._count = len(data) / SBObjectIDs.ID.size
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError("Index out of range")
+
+        return SBObjectIDs.ID.unpack_from(self._map, self._base + index * SBObjectIDs.ID.size)[0]
+
+    def __contains__(self, id):
+        i = bisect_left(self, id)
+
+        return i < self._count and self[i] == id
+
 class SBObjects(SoundbankChunk):
     HEAD = "HIRC"
 
@@ -1502,52 +2047,171 @@ class SBObjects(SoundbankChunk):
 
             self.length = data.read_uint32()
             self.quantity = data.read_uint32()
-            self.objects = [SBObject(data) for i in xrange(self.quantity)]
-            self._ids = None
+            self.objects = SBObjectList(SBObject(data) for i in xrange(self.quantity))
         else:
             self.head = SBObjects.HEAD
             self.length = None
             self.quantity = 0
-            self.objects = []
-            self._ids = None
+            self.objects = SBObjectList()
+
+        self._ids = None
+        self._reserved = set()
+        self._references = None
 
     def calculate_length(self):
         self.quantity = len(self.objects)
         self.length = 4
         self.length += sum((5 + obj.length) for obj in self.objects)
+        self._references = None
 
-    def _read_ids(self):
-        db = FileRead("objectids.db")
+    def get_references(self):
+        if self._references is None:
+            self._references = SBReferences(self.objects)
 
-        hash = db.read_uchar(sha1().digestsize)
-        data = db.read_data()
+        return self._references
 
-        del db
+    def get_new_ids(self, count):
+        """ Returns count ids used neither by the game nor by this bank, nor handed out before. """
 
-        if sha1(data).digest() != hash:
-            raise SBObjectsError("Invalid object ids database")
+        if self._ids is None:
+            self._ids = SBObjectIDs()
+
+        nids = []
 
-        self._ids = [struct.unpack("<I", data[i:i+4])[0] for i in xrange(0, len(data), 4)]
+        while len(nids) < count:
+            nid = Random.uint32()
+
+            if nid == 0 or nid in self._reserved or self.objects.get(nid) is not None or nid in self._ids:
+                continue
+
+            self._reserved.add(nid)
+            nids.append(nid)
+
+        return nids
 
     def get_new_id(self):
-        if self._ids is None:
-            self._read_ids()
+        return self.get_new_ids(1)[0]
 
-        nid = -1
+class SBReferences(object):
+    """ Reverse-reference graph over the id fields decoded from HIRC objects. """
 
-        while nid == -1:
-            nid = Random.uint32()
+    MEDIA_FIELDS = ("audio_id", "id1")
+    PARENT_FIELD = "parent_id"
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.order = {}
+        self.media = {}
+        self.referrers = {}
+        self.parents = {}
+
+        for (i, obj) in enumerate(objects):
+            self.order.setdefault(obj.id, i)
+
+            for (field, id) in SBReferences.get_fields(obj):
+                if field in SBReferences.MEDIA_FIELDS:
+                    self.media.setdefault(id, []).append(obj)
+                else:
+                    self.referrers.setdefault(id, []).append((obj, field))
+
+                    if field == SBReferences.PARENT_FIELD:
+                        self.parents.setdefault(obj.id, []).append(id)
+
+    @staticmethod
+    def get_fields(obj):
+        if obj.type == SBObject.TYPE_SOUND:
+            yield ("audio_id", obj.obj.audio_id)
+        elif obj.type == SBObject.TYPE_MUSIC_TRACK:
+            if obj.obj.id1 > 0:
+                yield ("id1", obj.obj.id1)
+        elif obj.type == SBObject.TYPE_EVENT:
+            for id in obj.obj.event_action_ids:
+                yield ("event_action_ids", id)
+        elif obj.type == SBObject.TYPE_EVENT_ACTION:
+            yield ("game_object_id", obj.obj.game_object_id)
+        elif obj.type == SBObject.TYPE_MUSIC_SEGMENT:
+            for id in obj.obj.child_ids:
+                yield ("child_ids", id)
+
+            if obj.obj.sound_structure.parent_id > 0:
+                yield ("parent_id", obj.obj.sound_structure.parent_id)
+        elif obj.type == SBObject.TYPE_MUSIC_PLAYLIST:
+            for id in obj.obj.segment_ids:
+                yield ("segment_ids", id)
+
+            if obj.obj.sound_structure.parent_id > 0:
+                yield ("parent_id", obj.obj.sound_structure.parent_id)
+
+    def sort(self, objects):
+        return sorted(objects, key=lambda obj: self.order.get(obj.id, -1))
+
+    def get_media_owners(self, audio_id):
+        return list(self.media.get(audio_id, ()))
+
+    def get_referrers(self, id, fields=None):
+        seen = set()
+        referrers = []
+
+        for (obj, field) in self.referrers.get(id, ()):
+            if (fields is None or field in fields) and (obj.id, field) not in seen:
+                seen.add((obj.id, field))
+                referrers.append((obj, field))
+
+        return referrers
+
+    def get_owners(self, id):
+        owners = [obj for (obj, field) in self.referrers.get(id, ()) if field != SBReferences.PARENT_FIELD]
+
+        for parent_id in self.parents.get(id, ()):
+            parent = self.objects.get(parent_id)
 
-            if nid in self._ids:
-                nid = -1
+            if parent is not None:
+                owners.append(parent)
+
+        return owners
+
+    def get_media(self, id):
+        """ Returns the media ids reached from id going down the decoded id fields, e.g. what an event plays. """
+
+        queue = [id]
+        seen = set()
+        media = set()
+
+        while queue:
+            obj = self.objects.get(queue.pop())
+
+            if obj is None or obj.id in seen:
                 continue
 
-            for obj in self.objects:
-                if obj.id == nid:
-                    nid = -1
-                    break
+            seen.add(obj.id)
 
-        return nid
+            for (field, ref) in SBReferences.get_fields(obj):
+                if field in SBReferences.MEDIA_FIELDS:
+                    media.add(ref)
+                elif field != SBReferences.PARENT_FIELD:
+                    queue.append(ref)
+
+        return media
+
+    def get_reachers(self, id, types=None):
+        queue = self.get_media_owners(id) + self.get_owners(id)
+        seen = set()
+        reachers = []
+
+        while queue:
+            obj = queue.pop()
+
+            if obj.id in seen:
+                continue
+
+            seen.add(obj.id)
+
+            if types is None or obj.type in types:
+                reachers.append(obj)
+
+            queue.extend(self.get_owners(obj.id))
+
+        return self.sort(reachers)
 
 class SBSoundTypeID(SoundbankChunk):
     HEAD = "STID"
@@ -1567,6 +2231,7 @@ class SBSoundTypeID(SoundbankChunk):
             self.quantity = data.read_uint32()
             self.remaining = data.read_uchar(self.length - 8)
         else:
+            self.head = SBSoundTypeID.HEAD
             self.length = None
             self.unk_field32_1 = 1
             self.quantity = 0
@@ -1705,24 +2370,91 @@ class SBEnvironments(SoundbankChunk):
             self.unk_data = None
 
 class WEM(object):
+    DIDX_ENTRY = struct.Struct("<III")
+    COPY_SIZE = 0x100000
+
     def __init__(self, data=None):
         if data is not None:
             self.id = data.read_uint32()
             self.offset = data.read_uint32()
             self.size = data.read_uint32()
-            self.data = None
         else:
             self.id = None
             self.offset = None
             self.size = None
-            self.data = None
+
+        self._data = None
+        self._view = None
+        self._path = None
+
+    def _get_data(self):
+        if self._data is None:
+            if self._view is not None:
+                self._data = self._view[:]
+            elif self._path is not None:
+                with open(self._path, "rb") as f:
+                    self._data = f.read()
+
+            self._view = None
+            self._path = None
+
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self._view = None
+        self._path = None
+
+    data = property(_get_data, _set_data)
+
+    def attach_file(self, path):
+        """ Backs the payload by a file on disk, only read when written out. """
+
+        self._data = None
+        self._view = None
+        self._path = path
+
+    def replace(self, wem):
+        self.size = wem.size
+        self._data = wem._data
+        self._view = wem._view
+        self._path = wem._path
+
+    def digest(self):
+        """ SHA1 of the payload, reading an attached file in chunks without keeping it. """
+
+        if self._data is None and self._view is None and self._path is not None:
+            return hash_file(self._path)
+
+        return sha1(self.data or "").digest()
+
+    def write(self, file):
+        if self._data is not None:
+            file.write_uchar(self._data)
+        elif self._view is not None:
+            file.write_uchar(self._view)
+        elif self._path is not None:
+            with open(self._path, "rb") as f:
+                chunk = f.read(WEM.COPY_SIZE)
+
+                while chunk:
+                    file.write_uchar(chunk)
+                    chunk = f.read(WEM.COPY_SIZE)
 
 class FileRead(object):
-    def __init__(self, file):
-        self.path = file
-        self.file = open(self.path, "rb")
-        self.name = os.path.basename(file)
-        self.size = os.path.getsize(file)
+    def __init__(self, file, isBuffer=False):
+        if not isBuffer:
+            self.path = file
+            self.file = open(self.path, "rb")
+            self.name = os.path.basename(file)
+            self.size = os.path.getsize(file)
+        else:
+            self.path = None
+            self.file = file
+            self.name = None
+            self.size = None
+
+        self._map = None
 
     def __del__(self):
         try:
@@ -1781,6 +2513,14 @@ class FileRead(object):
     def read_double(self):
         return struct.unpack("<d", self.file.read(8))[0]
 
+    def read_struct(self, fmt):
+        return fmt.unpack(self.file.read(fmt.size))
+
+    def read_array(self, fmt, count):
+        fmt = "<%i%s" % (count, fmt)
+
+        return list(struct.unpack(fmt, self.file.read(struct.calcsize(fmt))))
+
     def read_header(self):
         return self.read_uchar(4)
 
@@ -1804,6 +2544,21 @@ class FileRead(object):
     def read_data(self):
         return self.file.read()
 
+    def map(self):
+        if self._map is None:
+            self._map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._map
+
+    def read_view(self, size):
+        if self.path is None:
+            return self.read_uchar(size)
+
+        offset = self.where()
+        self.goto(size, 1)
+
+        return buffer(self.map(), offset, size)
+
     def where(self):
         return self.file.tell()
 
@@ -1871,98 +2626,780 @@ class FileWrite(object):
     def write_double(self, data):
         self.file.write(struct.pack("<d", data))
 
+    def write_struct(self, fmt, *data):
+        self.file.write(fmt.pack(*data))
+
+    def write_array(self, fmt, data):
+        self.file.write(struct.pack("<%i%s" % (len(data), fmt), *data))
+
+    def reserve_uint32(self):
+        pos = self.where()
+        self.write_uint32(0)
+
+        return pos
+
+    def patch_uint32(self, pos, data):
+        cur = self.where()
+        self.goto(pos)
+        self.write_uint32(data)
+        self.goto(cur)
+
     def where(self):
         return self.file.tell()
 
     def goto(self, offset, whence=0):
         self.file.seek(offset, whence)
 
-class Soundbank(object):
-    MODE_BUILD             = 0
-    MODE_BUILD_MUSIC       = 1
-    MODE_ADD_NEW_MUSIC     = 2
-    MODE_PLAYLIST_ID       = 3
-    MODE_EXPORT_PLAYLIST   = 4
-    MODE_REIMPORT_PLAYLIST = 5
-    MODE_DUMP_SOUNDS       = 6
-    MODE_DEBUG             = 7
-    MODE_DEBUG_EVENT       = 8
-    MODE_DEBUG_SOUND       = 9
-    MODE_DEBUG_OBJECT      = 10
-    MODE_DEBUG_OWNER       = 11
+class FileBatch(object):
+    """ Gathers small writes into large ones, applying back-patches in memory or on close. """
 
-    def __init__(self, file):
-        try:
-            self.file = FileRead(file)
-        except (OSError, IOError):
-            raise SoundbankError("Could not open soundbank")
+    BUFFER_SIZE = 0x100000
 
-        self._file = file
-        self.header = None
-        self.data_index = None
-        self.data = None
-        self.objects = None
-        self.stid = None
-        self.stmg = None
-        self.envs = None
-        self.to_add = []
+    def __init__(self, file, size=BUFFER_SIZE):
+        self.file = file
+        self.size = size
+        self.pending = bytearray()
+        self.patches = []
+        self.base = 0
+        self.pos = 0
 
     def __del__(self):
         try:
-            del self.file
+            self.close()
         except Exception:
             pass
 
-    def read(self):
-        self.header = SBHeader(self.file)
-        self.isInit = self.file.name == "Init.bnk"
+    def tell(self):
+        return self.pos
 
-        if not self.isInit:
-            #try:
-                #self.unk_chunk = self.file.read_until(SBDataIndex.HEAD)
-            #except LookupError:
-                #try:
-                    #self.unk_chunk = self.file.read_until(SBData.HEAD)
-                #except LookupError:
-                    #try:
-                        #self.unk_chunk = self.file.read_until(SBObjects.HEAD)
-                    #except LookupError:
-                        #raise SoundbankError("Invalid file")
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.base + len(self.pending)
 
-            self.data_index = SBDataIndex(self.file)
-            self.data = SBData(self.file)
+        self.pos = offset
 
-            if self.data:
-                self.data.read_data(self.file, self.data_index)
+    def write(self, data):
+        end = self.base + len(self.pending)
 
+        if self.pos == end:
+            if len(data) >= self.size:
+                self.flush()
+                self.file.write(data)
+                self.base += len(data)
+            else:
+                self.pending += data
+
+                if len(self.pending) >= self.size:
+                    self.flush()
+        elif self.pos > end:
+            raise IOError("Cannot write past the end of the stream")
+        elif self.pos >= self.base and self.pos + len(data) <= end:
+            self.pending[self.pos - self.base:self.pos - self.base + len(data)] = data
         else:
-            #try:
-                #self.unk_chunk = self.file.read_until(SBManager.HEAD)
-            #except LookupError:
-                #raise SoundbankError("Invalid file")
+            self.flush()
 
-            self.stmg = SBManager(self.file)
+            if self.pos + len(data) > self.base:
+                raise IOError("Cannot patch across the end of the stream")
 
-        self.objects = SBObjects(self.file)
+            self.patches.append((self.pos, str(data)))
 
-        if not self.isInit:
-            self.stid = SBSoundTypeID(self.file)
-        else:
-            self.envs = SBEnvironments(self.file)
+        self.pos += len(data)
 
-        del self.file
+    def flush(self):
+        if self.pending:
+            self.file.write(self.pending)
+            self.base += len(self.pending)
+            self.pending = bytearray()
 
-    def debug(self):
-        print "--- HEADER ---"
-        print "HEAD : " + self.header.head
-        print "LENGTH: %i" % (self.header.length)
-        print "VERSION: %i" % (self.header.version)
-        print "ID: %i" % (self.header.id)
-        print "UNK FIELD32 1: %i" % (self.header.unk_field32_1)
-        print "UNK FIELD32 2: %i" % (self.header.unk_field32_2)
+    def close(self):
+        if self.file.closed:
+            return
 
-        if self.header.unk_data is not None:
-            print "UNK DATA LENGTH: %i" % (len(self.header.unk_data))
+        self.flush()
+
+        for (pos, data) in self.patches:
+            self.file.seek(pos)
+            self.file.write(data)
+
+        self.patches = []
+        self.file.close()
+
+class FileCompare(object):
+    """ File-like sink comparing the stream with the original file instead of writing it. """
+
+    BLOCK_SIZE = 0x1000
+    MAX_PENDING = 16
+
+    def __init__(self, path):
+        try:
+            self.file = open(path, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, IOError, ValueError):
+            raise SoundbankError("Could not map soundbank")
+
+        self.size = len(self.map)
+        self.pos = 0
+        self.end = 0
+        self.first = None
+        self.pending = set()
+        self.closed = False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.end
+
+        self.pos = offset
+
+    @staticmethod
+    def difference(original, data, start=0):
+        """ Returns the index of the first byte of data differing from original from start on, or None. """
+
+        block = start
+
+        while block < len(data):
+            if original[block:block + FileCompare.BLOCK_SIZE] != data[block:block + FileCompare.BLOCK_SIZE]:
+                for i in xrange(block, min(block + FileCompare.BLOCK_SIZE, len(data))):
+                    if i >= len(original) or original[i] != data[i]:
+                        return i
+
+            block += FileCompare.BLOCK_SIZE
+
+        return None
+
+    def _differ(self, offset):
+        if self.first is None or offset < self.first:
+            self.first = offset
+
+    def write(self, data):
+        if self.pos > self.end:
+            raise IOError("Cannot write past the end of the stream")
+
+        data = str(data)
+        end = self.pos + len(data)
+
+        if self.pos < self.end:
+            self.pending = set(offset for offset in self.pending if not self.pos <= offset < end)
+
+        original = self.map[self.pos:end]
+
+        if original != data:
+            i = FileCompare.difference(original, data)
+            count = 0
+
+            while i is not None:
+                if count == FileCompare.MAX_PENDING:
+                    self._differ(self.pos + i)
+                    break
+
+                self.pending.add(self.pos + i)
+                count += 1
+                i = FileCompare.difference(original, data, i + 1)
+
+        self.pos = end
+        self.end = max(self.end, end)
+
+    def close(self):
+        if self.closed:
+            return
+
+        if self.end != self.size:
+            self._differ(min(self.end, self.size))
+
+        for offset in self.pending:
+            self._differ(offset)
+
+        self.pending = set()
+        self.closed = True
+
+    def chunks(self):
+        chunks = []
+        offset = 0
+
+        while offset + 8 <= self.size:
+            (head, length) = struct.unpack_from("<4sI", self.map, offset)
+            chunks.append((head, offset, offset + 8 + length))
+            offset += 8 + length
+
+        return chunks
+
+class SBSnapshot(object):
+    """ Object table of a soundbank cached next to it. """
+
+    EXT = ".snapshot"
+    MAGIC = "SBSN"
+    VERSION = 1
+    HEAD = struct.Struct("<4sIQdQ20sII")
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.cache = path + SBSnapshot.EXT
+
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+    @staticmethod
+    def _hash(data, offset, length):
+        return sha1(buffer(data.map(), offset, length)).digest()
+
+    @staticmethod
+    def _column(typecode, raw):
+        column = array(typecode, raw)
+
+        if sys.byteorder != "little":
+            column.byteswap()
+
+        return column
+
+    def load(self, data):
+        """ Returns the SBObjects of the HIRC chunk at the position of data, or None if stale. """
+
+        offset = data.where()
+
+        try:
+            with open(self.cache, "rb") as f:
+                raw = f.read()
+
+            (magic, version, size, mtime, hirc, hash, count, path) = SBSnapshot.HEAD.unpack_from(raw)
+        except (OSError, IOError, struct.error):
+            return None
+
+        pos = SBSnapshot.HEAD.size + path
+        columns = [pos + (count * i) for i in (0, 1, 5, 9, 13)]
+
+        if (magic, version, size, mtime, hirc) != (SBSnapshot.MAGIC, SBSnapshot.VERSION, self.size, self.mtime, offset) or \
+           raw[SBSnapshot.HEAD.size:pos] != self.path.encode("utf-8") or len(raw) != columns[-1]:
+            return None
+
+        head = data.read_header()
+        length = data.read_uint32()
+        quantity = data.read_uint32()
+
+        if head != SBObjects.HEAD or quantity != count or SBSnapshot._hash(data, offset, 8 + length) != hash:
+            data.goto(offset)
+            return None
+
+        types = SBSnapshot._column("B", raw[columns[0]:columns[1]])
+        (ids, offsets, lengths) = (SBSnapshot._column(SBDataTable.TYPECODE, raw[columns[i]:columns[i + 1]]) for i in (1, 2, 3))
+        view = data.map()
+
+        objects = SBObjects()
+        objects.length = length
+        objects.quantity = quantity
+        objects.objects = SBObjectList(SBObject.from_raw(types[i], ids[i], offsets[i], buffer(view, offsets[i], lengths[i]))
+                                       for i in xrange(count))
+
+        data.goto(offset + 8 + length)
+
+        return objects
+
+    def save(self, data, objects, offset):
+        """ Writes the snapshot of objects, read from the HIRC chunk at offset. Failures are ignored. """
+
+        columns = [array("B", (obj.type for obj in objects.objects))]
+        columns += [array(SBDataTable.TYPECODE, (getattr(obj, name) for obj in objects.objects)) for name in ("id", "offset", "length")]
+
+        if sys.byteorder != "little":
+            for column in columns:
+                column.byteswap()
+
+        path = self.path.encode("utf-8")
+        hash = SBSnapshot._hash(data, offset, 8 + objects.length)
+
+        try:
+            with open(self.cache, "wb") as f:
+                f.write(SBSnapshot.HEAD.pack(SBSnapshot.MAGIC, SBSnapshot.VERSION, self.size, self.mtime, offset, hash, len(objects.objects), len(path)))
+                f.write(path)
+
+                for column in columns:
+                    f.write(column.tostring())
+        except (OSError, IOError):
+            pass
+
+class SBCorpus(object):
+    """ SQLite index of the objects, references and media of a folder of soundbanks. """
+
+    MAGIC = "SQLite format 3\0"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS banks (bank INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, size INTEGER NOT NULL,
+                                          mtime REAL NOT NULL, id INTEGER, error TEXT);
+        CREATE TABLE IF NOT EXISTS objects (bank INTEGER NOT NULL, id INTEGER NOT NULL, type INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS refs (bank INTEGER NOT NULL, id INTEGER NOT NULL, type INTEGER NOT NULL,
+                                         field TEXT NOT NULL, ref INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS media (bank INTEGER NOT NULL, id INTEGER NOT NULL, offset INTEGER NOT NULL,
+                                          size INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS objects_id ON objects (id);
+        CREATE INDEX IF NOT EXISTS objects_bank ON objects (bank);
+        CREATE INDEX IF NOT EXISTS refs_ref ON refs (ref, field);
+        CREATE INDEX IF NOT EXISTS refs_bank ON refs (bank);
+        CREATE INDEX IF NOT EXISTS media_id ON media (id);
+        CREATE INDEX IF NOT EXISTS media_bank ON media (bank);
+    """
+
+    def __init__(self, path, create=False):
+        if not create and not os.path.isfile(path):
+            raise SBCorpusError("Corpus index %s not found" % (path))
+
+        try:
+            self.db = sqlite3.connect(path)
+            self.db.text_factory = str
+            self.db.executescript(SBCorpus.SCHEMA)
+        except sqlite3.Error:
+            raise SBCorpusError("Could not open corpus index")
+
+    @staticmethod
+    def is_corpus(path):
+        try:
+            with open(path, "rb") as f:
+                return f.read(len(SBCorpus.MAGIC)) == SBCorpus.MAGIC
+        except (OSError, IOError):
+            return False
+
+    def _forget(self, bank):
+        for table in ("objects", "refs", "media", "banks"):
+            self.db.execute("DELETE FROM %s WHERE bank = ?" % (table), (bank,))
+
+    def update(self, folder, processes=None):
+        """ Indexes the new and changed soundbanks under folder, forgets the removed ones. """
+
+        start = time.time()
+        folder = os.path.join(os.path.abspath(folder), "")
+        known = {}
+
+        for (bank, path, size, mtime) in self.db.execute("SELECT bank, path, size, mtime FROM banks"):
+            if path.startswith(folder):
+                known[path] = (bank, size, mtime)
+
+        paths = find_banks(folder)
+        jobs = []
+
+        for path in paths:
+            stat = os.stat(path)
+            old = known.pop(path, None)
+
+            if old is None or old[1:] != (stat.st_size, stat.st_mtime):
+                jobs.append(path)
+
+        with self.db:
+            for (bank, size, mtime) in known.itervalues():
+                self._forget(bank)
+
+        results = run_jobs(index_job, jobs, processes, self._store)
+
+        print
+        print "[*] Indexed: %i, Failed: %i, Unchanged: %i, Removed: %i (%.3fs)" % (results.get("OK", 0), results.get("FAILED", 0),
+            len(paths) - len(jobs), len(known), time.time() - start)
+
+        return not results.get("FAILED")
+
+    def _store(self, result):
+        (path, size, mtime, rows, elapsed, message) = result
+
+        with self.db:
+            for (bank,) in self.db.execute("SELECT bank FROM banks WHERE path = ?", (path,)).fetchall():
+                self._forget(bank)
+
+            if rows is None:
+                self.db.execute("INSERT INTO banks (path, size, mtime, error) VALUES (?, ?, ?, ?)", (path, size, mtime, message))
+                print "[FAILED] %s (%.3fs): %s" % (path, elapsed, message)
+                return "FAILED"
+
+            (id, objects, refs, media) = rows
+            bank = self.db.execute("INSERT INTO banks (path, size, mtime, id) VALUES (?, ?, ?, ?)", (path, size, mtime, id)).lastrowid
+
+            self.db.executemany("INSERT INTO objects VALUES (%i, ?, ?)" % (bank), objects)
+            self.db.executemany("INSERT INTO refs VALUES (%i, ?, ?, ?, ?)" % (bank), refs)
+            self.db.executemany("INSERT INTO media VALUES (%i, ?, ?, ?)" % (bank), media)
+
+        print "[OK] %s (%.3fs)" % (path, elapsed)
+
+        return "OK"
+
+    def find(self, id):
+        rows = self.db.execute("SELECT banks.path, 'OBJECT', objects.type FROM objects JOIN banks USING (bank) WHERE objects.id = ? "
+                               "UNION ALL SELECT banks.path, 'MEDIA', NULL FROM media JOIN banks USING (bank) WHERE media.id = ? "
+                               "ORDER BY 1", (id, id)).fetchall()
+
+        if not rows:
+            print "ID %i was not found within corpus." % (id)
+
+            return
+
+        for (path, kind, type) in rows:
+            if kind == "MEDIA":
+                print "%s: MEDIA" % (path)
+            else:
+                print "%s: OBJECT (TYPE %i)" % (path, type)
+
+    def debug_owner(self, audio_id):
+        owners = self.db.execute("SELECT banks.path, refs.id, refs.type FROM refs JOIN banks USING (bank) "
+                                 "WHERE refs.ref = ? AND refs.field IN (?, ?) ORDER BY banks.path, refs.rowid",
+                                 (audio_id,) + SBReferences.MEDIA_FIELDS).fetchall()
+        found = set()
+
+        for (path, id, type) in owners:
+            if path in found:
+                continue
+
+            found.add(path)
+
+            print "Bank: %s" % (path)
+            print "Object Owner ID: %i" % (id)
+            print "Object Owner Type: %s" % ("SOUND" if type == SBObject.TYPE_SOUND else "MUSIC")
+
+        if not found:
+            print "No object owner found for audio ID %i." % (audio_id)
+
+    def debug_references(self, id):
+        references = self.db.execute("SELECT banks.path, refs.id, refs.type, refs.field FROM refs JOIN banks USING (bank) "
+                                     "WHERE refs.ref = ? ORDER BY banks.path, refs.field NOT IN (?, ?), refs.rowid",
+                                     (id,) + SBReferences.MEDIA_FIELDS).fetchall()
+
+        if not references:
+            print "No references found for ID %i." % (id)
+
+            return
+
+        for (path, referrer, type, field) in references:
+            if field in SBReferences.MEDIA_FIELDS:
+                print "%s: Media Owner ID: %i (TYPE %i)" % (path, referrer, type)
+            else:
+                print "%s: Referrer ID: %i (TYPE %i, FIELD %s)" % (path, referrer, type, field)
+
+    def get_playlist_ids(self, wid):
+        if wid < 1 or wid > 0xFFFFFFFF:
+            raise SoundbankError("Invalid music ID")
+
+        playlists = self.db.execute("SELECT banks.path, playlists.id FROM refs AS tracks "
+                                    "JOIN refs AS segments ON segments.bank = tracks.bank AND segments.ref = tracks.id "
+                                    "AND segments.field = 'child_ids' AND segments.type = ? "
+                                    "JOIN refs AS playlists ON playlists.bank = segments.bank AND playlists.ref = segments.id "
+                                    "AND playlists.field = 'segment_ids' AND playlists.type = ? "
+                                    "JOIN banks ON banks.bank = tracks.bank "
+                                    "WHERE tracks.ref = ? AND tracks.field = 'id1' AND tracks.type = ? "
+                                    "GROUP BY banks.path, playlists.id ORDER BY banks.path, MIN(playlists.rowid)",
+                                    (SBObject.TYPE_MUSIC_SEGMENT, SBObject.TYPE_MUSIC_PLAYLIST, wid, SBObject.TYPE_MUSIC_TRACK)).fetchall()
+
+        if not playlists:
+            raise SoundbankError("%i has no music playlists within corpus" % (wid))
+
+        banks = []
+
+        for (path, id) in playlists:
+            if not banks or banks[-1][0] != path:
+                banks.append((path, []))
+
+            banks[-1][1].append("'%i'" % (id))
+
+        for (path, playlist_ids) in banks:
+            print "[*] Bank: %s" % (path)
+            print "[*] Playlists found: %i" % len(playlist_ids)
+            print "[*] Playlists IDs: %s" % (", ".join(playlist_ids))
+            print
+
+class WEMStore(object):
+    """ WEM payloads stored once under their SHA1, with a manifest of the (bank, id) using each. """
+
+    MANIFEST = "manifest.csv"
+    OBJECTS = "objects"
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = os.path.join(path, WEMStore.MANIFEST)
+
+        try:
+            os.makedirs(os.path.join(path, WEMStore.OBJECTS))
+        except OSError:
+            if not os.path.isdir(os.path.join(path, WEMStore.OBJECTS)):
+                raise WEMStoreError("Could not create WEM store")
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isfile(os.path.join(path, WEMStore.MANIFEST)) and os.path.isdir(os.path.join(path, WEMStore.OBJECTS))
+
+    def get(self, digest):
+        return os.path.join(self.path, WEMStore.OBJECTS, digest[:2], digest + ".wem")
+
+    def put(self, digest, table, index):
+        """ Stores a DIDX payload under its SHA1 unless already there, returns whether it was added. """
+
+        path = self.get(digest)
+
+        if os.path.isfile(path):
+            return False
+
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+        temp = "%s.%i.tmp" % (path, os.getpid())
+
+        try:
+            with open(temp, "wb") as f:
+                table.write(index, FileWrite(f, True))
+
+            os.rename(temp, path)
+        except (OSError, IOError):
+            # Another process may have stored the same payload meanwhile.
+            if os.path.exists(temp):
+                os.remove(temp)
+
+            if not os.path.isfile(path):
+                raise WEMStoreError("Could not store %s" % (digest))
+
+            return False
+
+        return True
+
+    def read_manifest(self):
+        """ Returns {bank: [(id, size, digest)]}. """
+
+        banks = OrderedDict()
+
+        if not os.path.isfile(self.manifest):
+            return banks
+
+        try:
+            with open(self.manifest, "rb") as f:
+                for row in csv.reader(f):
+                    if not row or row[0].strip().startswith("#"):
+                        continue
+
+                    if len(row) != 4:
+                        raise WEMStoreError("Invalid manifest row: %s" % (", ".join(row)))
+
+                    banks.setdefault(row[0], []).append((int(row[1]), int(row[2]), row[3]))
+        except (OSError, IOError, ValueError, csv.Error):
+            raise WEMStoreError("Failed to read store manifest")
+
+        return banks
+
+    def write_manifest(self, banks):
+        temp = self.manifest + ".tmp"
+
+        try:
+            with open(temp, "wb") as f:
+                writer = csv.writer(f)
+                f.write("# bank, id, size, sha1\r\n")
+
+                for bank in sorted(banks):
+                    writer.writerows((bank, id, size, digest) for (id, size, digest) in banks[bank])
+
+            if os.path.exists(self.manifest):
+                os.remove(self.manifest)
+
+            os.rename(temp, self.manifest)
+        except (OSError, IOError, csv.Error):
+            raise WEMStoreError("Failed to write store manifest")
+
+    def find_rows(self, path, banks=None):
+        """ Returns the manifest rows of the bank whose relative path ends path, the longest such one. """
+
+        if banks is None:
+            banks = self.read_manifest()
+
+        path = os.path.normcase(os.path.abspath(path))
+        match = None
+
+        for bank in banks:
+            name = os.path.normcase(os.path.normpath(bank))
+
+            if (path == name or path.endswith(os.sep + name)) and (match is None or len(bank) > len(match)):
+                match = bank
+
+        return banks[match] if match is not None else []
+
+    def extract(self, folder, processes=None):
+        start = time.time()
+        paths = find_banks(folder)
+        banks = self.read_manifest()
+        totals = [0, 0, 0, 0]
+
+        def stored(result):
+            (path, status, elapsed, rows, added, message) = result
+            bank = os.path.relpath(path, folder).replace(os.sep, "/")
+
+            if status == "OK":
+                banks[bank] = rows
+                totals[0] += len(rows)
+                totals[1] += sum(size for (id, size, digest) in rows)
+                totals[2] += len(added)
+                totals[3] += sum(added)
+                message = "%i payloads, %i new" % (len(rows), len(added))
+            elif status == "SKIPPED":
+                banks.pop(bank, None)
+
+            print "[%s] %s (%.3fs): %s" % (status, path, elapsed, message)
+
+            return status
+
+        results = run_jobs(store_job, ((path, self.path) for path in paths), processes, stored)
+        self.write_manifest(banks)
+
+        print
+        print "[*] Payloads: %i (%i bytes), New: %i (%i bytes), Failed: %i, Skipped: %i (%.3fs)" % (totals[0], totals[1],
+            totals[2], totals[3], results.get("FAILED", 0), results.get("SKIPPED", 0), time.time() - start)
+
+        return not results.get("FAILED")
+
+class Soundbank(object):
+    MODE_BUILD             = 0
+    MODE_BUILD_MUSIC       = 1
+    MODE_ADD_NEW_MUSIC     = 2
+    MODE_PLAYLIST_ID       = 3
+    MODE_EXPORT_PLAYLIST   = 4
+    MODE_REIMPORT_PLAYLIST = 5
+    MODE_DUMP_SOUNDS       = 6
+    MODE_DEBUG             = 7
+    MODE_DEBUG_EVENT       = 8
+    MODE_DEBUG_SOUND       = 9
+    MODE_DEBUG_OBJECT      = 10
+    MODE_DEBUG_OWNER       = 11
+    MODE_DEBUG_REFERENCES  = 12
+    MODE_BATCH             = 13
+    MODE_BATCH_FOLDER      = 14
+    MODE_PATCH             = 15
+    MODE_INDEX             = 16
+    MODE_FIND              = 17
+    MODE_SHELL             = 18
+    MODE_VERIFY            = 19
+    MODE_STORE             = 20
+    MODE_EXPORT_PLAYLISTS  = 21
+    MODE_REIMPORT_PLAYLISTS = 22
+
+    MODES_QUERY = (MODE_PLAYLIST_ID, MODE_EXPORT_PLAYLIST, MODE_EXPORT_PLAYLISTS, MODE_DEBUG, MODE_DEBUG_EVENT, MODE_DEBUG_SOUND,
+                   MODE_DEBUG_OBJECT, MODE_DEBUG_OWNER, MODE_DEBUG_REFERENCES)
+
+    def __init__(self, file=None, snapshot=False):
+        if file is not None:
+            try:
+                self.file = FileRead(file)
+            except (OSError, IOError):
+                raise SoundbankError("Could not open soundbank")
+
+        self._file = file
+        self.snapshot = snapshot
+        self.isInit = False
+        self.header = None
+        self.data_index = None
+        self.data = None
+        self.objects = None
+        self.stid = None
+        self.stmg = None
+        self.envs = None
+        self.to_add = {}
+
+    def __del__(self):
+        try:
+            del self.file
+        except Exception:
+            pass
+
+    @Profile.phase("Read")
+    def read(self, media_only=False):
+        """ Parses the soundbank, stopping after the DATA chunk when media_only is set. """
+
+        with Profile.span("Read BKHD") as span:
+            self.header = SBHeader(self.file)
+            span.size = self.file.where()
+
+        self.isInit = self.file.name == "Init.bnk"
+
+        if not self.isInit:
+            #try:
+                #self.unk_chunk = self.file.read_until(SBDataIndex.HEAD)
+            #except LookupError:
+                #try:
+                    #self.unk_chunk = self.file.read_until(SBData.HEAD)
+                #except LookupError:
+                    #try:
+                        #self.unk_chunk = self.file.read_until(SBObjects.HEAD)
+                    #except LookupError:
+                        #raise SoundbankError("Invalid file")
+
+            with Profile.span("Read DIDX") as span:
+                self.data_index = SBDataIndex(self.file)
+
+                if self.data_index:
+                    span.size = self.data_index.length
+                    span.count = len(self.data_index.data_info)
+
+            with Profile.span("Read DATA") as span:
+                self.data = SBData(self.file)
+
+                if self.data:
+                    self.data.read_data(self.file, self.data_index)
+                    span.size = self.data.length
+
+            if media_only:
+                del self.file
+                return
+
+        else:
+            #try:
+                #self.unk_chunk = self.file.read_until(SBManager.HEAD)
+            #except LookupError:
+                #raise SoundbankError("Invalid file")
+
+            with Profile.span("Read STMG"):
+                self.stmg = SBManager(self.file)
+
+        with Profile.span("Read HIRC") as span:
+            self.objects = self._read_objects()
+            span.size = self.objects.length
+            span.count = len(self.objects.objects)
+
+        if not self.isInit:
+            with Profile.span("Read STID") as span:
+                self.stid = SBSoundTypeID(self.file)
+
+                if self.stid:
+                    span.size = self.stid.length
+        else:
+            with Profile.span("Read ENVS"):
+                self.envs = SBEnvironments(self.file)
+
+        del self.file
+
+    def _read_objects(self):
+        if not self.snapshot:
+            return SBObjects(self.file)
+
+        offset = self.file.where()
+        snapshot = SBSnapshot(self._file)
+        objects = snapshot.load(self.file)
+
+        if objects is None:
+            objects = SBObjects(self.file)
+            snapshot.save(self.file, objects, offset)
+
+        return objects
+
+    def debug(self):
+        print "--- HEADER ---"
+        print "HEAD : " + self.header.head
+        print "LENGTH: %i" % (self.header.length)
+        print "VERSION: %i" % (self.header.version)
+        print "ID: %i" % (self.header.id)
+        print "UNK FIELD32 1: %i" % (self.header.unk_field32_1)
+        print "UNK FIELD32 2: %i" % (self.header.unk_field32_2)
+
+        if self.header.unk_data is not None:
+            print "UNK DATA LENGTH: %i" % (len(self.header.unk_data))
 
         print "--- HEADER ---"
         print
@@ -1988,550 +3425,1376 @@ class Soundbank(object):
                 print "--- DATA ---"
                 print
 
-        else:
-            print "--- MANAGER ---"
-            print "HEAD: " + self.stmg.head
-            print "LENGTH: %i" % (self.stmg.length)
-            print "VOLUME: %f" % (self.stmg.volume)
-            print "MAX VOICE INSTANCES: %i" % (self.stmg.max_voice_instances)
-            print "STATE GROUPS: %i" % (self.stmg.state_groups_count)
-            print "SWITCH GROUPS: %i" % (self.stmg.switch_groups_count)
-            print "GAME PARAMETERS: %i" % (self.stmg.game_parameters_count)
-            print "--- MANAGER ---"
-            print
+        else:
+            print "--- MANAGER ---"
+            print "HEAD: " + self.stmg.head
+            print "LENGTH: %i" % (self.stmg.length)
+            print "VOLUME: %f" % (self.stmg.volume)
+            print "MAX VOICE INSTANCES: %i" % (self.stmg.max_voice_instances)
+            print "STATE GROUPS: %i" % (self.stmg.state_groups_count)
+            print "SWITCH GROUPS: %i" % (self.stmg.switch_groups_count)
+            print "GAME PARAMETERS: %i" % (self.stmg.game_parameters_count)
+            print "--- MANAGER ---"
+            print
+
+        print "--- OBJECTS ---"
+        print "HEAD: " + self.objects.head
+        print "LENGTH: %i" % (self.objects.length)
+        print "QUANTITY: %i" % (self.objects.quantity)
+
+        objTypes = {}
+
+        for obj in self.objects.objects:
+            try:
+                objTypes[obj.type] += 1
+            except KeyError:
+                objTypes[obj.type] = 1
+
+        for (key, value) in objTypes.iteritems():
+            print "TYPE %i: %i" % (key, value)
+
+        print "--- OBJECTS ---"
+        print
+
+        if not self.isInit:
+            if self.stid:
+                print "--- SOUND TYPE ID ---"
+                print "HEAD: " + self.stid.head
+                print "LENGTH: %i" % (self.stid.length)
+                print "UNK FIELD32 1: %i" % (self.stid.unk_field32_1)
+                print "QUANTITY: %i" % (self.stid.quantity)
+                print "REMAINING SIZE: %i" % (len(self.stid.remaining))
+                print "--- SOUND TYPE ID ---"
+                print
+
+        else:
+                print "--- ENVIRONMENTS ---"
+                print "HEAD: " + self.envs.head
+                print "LENGTH: %i" % (self.envs.length)
+                print "UNK DATA LENGTH: %i" % (len(self.envs.unk_data))
+                print "--- ENVIRONMENTS ---"
+                print
+
+    def debug_event(self, event_id):
+        event = self.objects.objects.get(event_id)
+
+        if event is not None:
+            if event.type == SBObject.TYPE_EVENT:
+                print "Event Object ID: %i" % (event.id)
+                print "Event Actions: %i" % (event.obj.event_actions)
+                print
+
+                for (i, action_id) in enumerate(event.obj.event_action_ids, 1):
+                    print "*** EVENT ACTION %03i ***" % (i)
+                    self.debug_event(action_id)
+                    print
+
+                return
+            elif event.type == SBObject.TYPE_EVENT_ACTION:
+                print "Event Action Object ID: %i" % (event.id)
+                print "Event Action Scope: %i" % (event.obj.scope)
+                print "Event Action Type: %i" % (event.obj.type)
+                print "Event Action Game Object ID: %i" % (event.obj.game_object_id)
+                print "UNK FIELD 8 1: %i" % (event.obj.unk_field8_1)
+                print "Event Action Additional Parameters Count: %i" % (event.obj.additional_parameters_count)
+                print ("Event Action Additional Parameters: %s" %
+                    (", ".join(
+                        "(%i: %.3f)" % (additional_parameter.type, additional_parameter.value)
+                        if additional_parameter.type == 0x10 else
+                        "(%i: %i)" % (additional_parameter.type, additional_parameter.value)
+                        for additional_parameter in event.obj.additional_parameters
+                    ))
+                )
+                print "UNK FIELD 8 2: %i" % (event.obj.unk_field8_2)
+
+                if event.obj.type == SBEventActionObject.ACTION_TYPE_SET_STATE:
+                    print "Event Action State Group ID: %i" % (event.obj.state_group_id)
+                    print "Event Action State ID: %i" % (event.obj.state_id)
+                elif event.obj.type == SBEventActionObject.ACTION_TYPE_SET_SWITCH:
+                    print "Event Action Switch Group ID: %i" % (event.obj.switch_group_id)
+                    print "Event Action Switch ID: %i" % (event.obj.switch_id)
+                #elif event.obj.type == 0x01:
+                    #print "UNK FIELD 32 1: %i" % (event.obj.unk_field32_1)
+                    #print "UNK FIELD 16 1: %i" % (event.obj.unk_field16_1)
+                    #print "UNK FIELD 32 2: %i" % (event.obj.unk_field32_2)
+                #elif event.obj.type == 0x04:
+                    #print "UNK FIELD 32 1: %i" % (event.obj.unk_field32_1)
+                    #print "UNK FIELD 8 3: %i" % (event.obj.unk_field8_3)
+
+                if event.obj.unk_data is not None:
+                    print "UNK DATA: %s" % (hexlify(event.obj.unk_data).upper())
+
+                print "---------- SOUND ----------"
+                self.debug_sound(event.obj.game_object_id)
+                print "---------- SOUND ----------"
+
+                return
+
+        print "No event object by ID %i." % (event_id)
+
+    def debug_sound(self, sound_id):
+        sound = self.objects.objects.get(sound_id)
+
+        if sound is not None:
+            if sound.type == SBObject.TYPE_SOUND:
+                print "Sound Object ID: %i" % (sound.id)
+                print "UNK FIELD 32 1: %i" % (sound.obj.unk_field32_1)
+                print "Sound Include Type: %i" % (sound.obj.include_type)
+                print "Sound Audio ID: %i" % (sound.obj.audio_id)
+                print "Sound Source ID: %i" % (sound.obj.source_id)
+
+                if sound.obj.include_type == SBSoundObject.SOUND_EMBEDDED:
+                    print "Sound Offset: %i" % (sound.obj.offset)
+                    print "Sound Size: %i" % (sound.obj.size)
+
+                print "Sound Type: %i" % (sound.obj.sound_type)
+                print "Sound Structure: %s" % (hexlify(sound.obj.sound_structure).upper())
+
+                return
+
+        print "No sound object by ID %i." % (sound_id)
+
+    def debug_object(self, object_id):
+        object = self.objects.objects.get(object_id)
+
+        if object is not None:
+            print "Object ID: %i" % (object.id)
+            print "Object Type: %i" % (object.type)
+            print "Object Size: %i" % (len(str(object.obj)))
+            print "Object Data: %s" % (hexlify(str(object.obj)).upper())
+
+            return
+
+        print "No object by ID %i." % (object_id)
+
+    def debug_owner(self, audio_id):
+        for owner in self.objects.get_references().get_media_owners(audio_id):
+            if owner.type == SBObject.TYPE_SOUND:
+                print "Object Owner ID: %i" % (owner.id)
+                print "Object Owner Type: SOUND"
+
+                return
+            elif owner.type == SBObject.TYPE_MUSIC_TRACK:
+                print "Object Owner ID: %i" % (owner.id)
+                print "Object Owner Type: MUSIC"
+
+                return
+
+        print "No object owner found for audio ID %i." % (audio_id)
+
+    def debug_references(self, id):
+        references = self.objects.get_references()
+        owners = references.get_media_owners(id)
+        referrers = references.get_referrers(id)
+
+        if not owners and not referrers:
+            print "No references found for ID %i." % (id)
+
+            return
+
+        for owner in owners:
+            print "Media Owner ID: %i (TYPE %i)" % (owner.id, owner.type)
+
+        for (referrer, field) in referrers:
+            print "Referrer ID: %i (TYPE %i, FIELD %s)" % (referrer.id, referrer.type, field)
+
+        for reacher in references.get_reachers(id, (SBObject.TYPE_MUSIC_PLAYLIST, SBObject.TYPE_EVENT)):
+            print "Reached By ID: %i (TYPE %i)" % (reacher.id, reacher.type)
+
+    @Profile.phase("Load WEMs")
+    def read_wems(self, folder, strict=True):
+        if WEMStore.is_store(folder):
+            self.read_store(WEMStore(folder))
+            return
+
+        try:
+            for file in os.listdir(folder):
+                if not file.endswith(".wem"):
+                    raise SoundbankError("%s is not a WEM file" % (file))
+
+                try:
+                    wid = int(file[:-4])
+                except ValueError:
+                    if strict:
+                        raise
+
+                    continue
+
+                if self.data_index.data_info.get(wid) is None:
+                    continue
+
+                path = folder + os.sep + file
+
+                if not os.path.isfile(path):
+                    raise SoundbankError("%s is not a WEM file" % (file))
+
+                wem = WEM()
+                wem.id = wid
+                wem.size = os.path.getsize(path)
+                wem.attach_file(path)
+
+                self.to_add[wem.id] = wem
+
+        except (OSError, IOError, ValueError):
+            raise SoundbankError("Failed to load new WEMs")
+
+    def read_store(self, store, banks=None):
+        """ Loads the stored payloads of the manifest rows of this soundbank which differ from its own. """
+
+        table = self.data_index.data_info
+
+        for (id, size, digest) in store.find_rows(self._file, banks):
+            i = table.find(id)
+
+            if i is None or (size == table.sizes[i] and digest == hexlify(table.digest(i))):
+                continue
+
+            path = store.get(digest)
+
+            if not os.path.isfile(path):
+                raise WEMStoreError("%s is not within the store" % (digest))
+
+            wem = WEM()
+            wem.id = id
+            wem.size = os.path.getsize(path)
+            wem.attach_file(path)
+
+            self.to_add[wem.id] = wem
+
+    @Profile.phase("Replace WEMs")
+    def rebuild_data(self):
+        for data_info in self.data_index.data_info:
+            wem = self.to_add.get(data_info.id)
+
+            if wem is not None:
+                data_info.replace(wem)
+
+    @Profile.phase("Patch")
+    def patch_bnk(self):
+        """ Writes the loaded WEMs over their old DATA ranges, returns False if one does not fit. """
+
+        if self.isInit or not self.data_index or not self.data:
+            return False
+
+        offsets = sorted(set(data_info.offset for data_info in self.data_index.data_info))
+        ends = dict(zip(offsets, offsets[1:] + [self.data.length]))
+        shared = {}
+
+        for data_info in self.data_index.data_info:
+            shared[data_info.offset] = shared.get(data_info.offset, 0) + 1
+
+        patches = []
+
+        for (i, data_info) in enumerate(self.data_index.data_info):
+            wem = self.to_add.get(data_info.id)
+
+            if wem is None:
+                continue
+
+            if shared[data_info.offset] > 1 or wem.size > ends[data_info.offset] - data_info.offset:
+                return False
+
+            patches.append((i, data_info, wem))
+
+        sizes = dict((data_info.id, (self.data.offset + data_info.offset, wem.size)) for (i, data_info, wem) in patches)
+        media = []
+
+        for obj in self.objects.objects.get_type(SBObject.TYPE_SOUND):
+            embedded = SBSoundObject.peek_embedded(obj)
+
+            if embedded is None or embedded[0] not in sizes or embedded[1:] == sizes[embedded[0]]:
+                continue
+
+            if obj.offset is None:
+                raise SoundbankError("Sound object %i has no position within soundbank" % (obj.id))
+
+            media.append((obj, sizes[embedded[0]]))
+
+        ranges = [(self.data.offset + data_info.offset, wem.size) for (i, data_info, wem) in patches]
+        ranges += [(self.data_index.offset + (i * WEM.DIDX_ENTRY.size) + 8, 4) for (i, data_info, wem) in patches if wem.size != data_info.size]
+        ranges += [(obj.offset + SBSoundObject.MEDIA_POS, 8) for (obj, info) in media]
+
+        try:
+            file = FileWrite(self._file, mode="r+b")
+            backup = []
+
+            for (offset, length) in ranges:
+                file.goto(offset)
+                backup.append((offset, file.file.read(length)))
+        except (OSError, IOError):
+            raise SoundbankError("Could not open soundbank for patching")
+
+        # Put back every byte written so far if any write fails.
+        try:
+            for (i, data_info, wem) in patches:
+                file.goto(self.data.offset + data_info.offset)
+                wem.write(file)
+
+                if wem.size != data_info.size:
+                    file.goto(self.data_index.offset + (i * WEM.DIDX_ENTRY.size) + 8)
+                    file.write_uint32(wem.size)
+
+            for (obj, (offset, size)) in media:
+                file.goto(obj.offset + SBSoundObject.MEDIA_POS)
+                file.write_uint32(offset)
+                file.write_uint32(size)
+
+            file.file.flush()
+        except BaseException:
+            for (offset, data) in backup:
+                file.goto(offset)
+                file.write_uchar(data)
+
+            del file
+            raise
+
+        del file
+
+        for (i, data_info, wem) in patches:
+            data_info.replace(wem)
+
+        for (obj, (offset, size)) in media:
+            if obj.is_decoded():
+                obj.obj.offset = offset
+                obj.obj.size = size
+
+        return True
+
+    @staticmethod
+    def read_music(wem):
+        """ Returns (WEM ID, length in ms) of a music WEM, reading its headers only. """
+
+        try:
+            mid = int(os.path.basename(wem)[:-4])
+        except ValueError:
+            mid = 0
+
+        if mid < 1 or mid > 0xFFFFFFFF:
+            raise SoundbankError("Invalid WEM ID")
+
+        _wem = compare_wem.WEM(wem)
+        _wem.read(True)
+
+        new_time = (_wem.sample_count / float(_wem.sample_rate)) * 1000
+
+        del _wem
+
+        return (mid, new_time)
+
+    @Profile.phase("Rebuild music")
+    def rebuild_music(self, wems):
+        """ A segment holding tracks of several WEMs keeps the track of the first WEM listed. """
+
+        if isinstance(wems, basestring):
+            wems = [wems]
+
+        times = OrderedDict(Soundbank.read_music(wem) for wem in wems)
+        ranks = dict((mid, rank) for (rank, mid) in enumerate(times))
+        trackids = {}
+
+        for obj in self.objects.objects.get_type(SBObject.TYPE_MUSIC_TRACK):
+            if obj.obj.id1 in times:
+                trackids[obj.id] = [obj, None]
+
+        missing = set(times).difference(track.obj.id1 for (track, segid) in trackids.itervalues())
+
+        if missing:
+            raise SoundbankError("Could not find ID %s within soundbank" % (", ".join(str(mid) for mid in sorted(missing))))
+
+        for obj in self.objects.objects.get_type(SBObject.TYPE_MUSIC_SEGMENT):
+            hasTrack = [trackid for trackid in obj.obj.child_ids if trackid in trackids]
+
+            if not hasTrack:
+                continue
+
+            trackid = min(hasTrack, key=lambda trackid: ranks[trackids[trackid][0].obj.id1])
+            new_time = times[trackids[trackid][0].obj.id1]
+
+            if len(obj.obj.child_ids) != 1:
+                obj.obj.children = 1
+                obj.obj.child_ids = [trackid]
+
+            obj.obj.unk_double_1 = 1000.0
+            obj.obj.unk_field64_1 = 0
+            obj.obj.unk_field64_2 = 0
+            obj.obj.time_length = new_time
+            obj.obj.time_length_next = new_time
+            obj.calculate_length()
+            trackids[trackid][1] = obj.id
+
+        for (track, segid) in trackids.itervalues():
+            if segid is not None:
+                mid = track.obj.id1
+                track.obj = SBMusicTrackCustomObject(mid, times[mid], segid)
+                track.calculate_length()
+
+        self.objects.calculate_length()
+
+    def add_music(self, wem):
+        return self.add_musics([wem])[0][1]
+
+    @Profile.phase("Add music")
+    def add_musics(self, wems):
+        """ Adds a track and a segment for each WEM, returns [(WEM ID, segment ID)]. """
+
+        musics = [Soundbank.read_music(wem) for wem in wems]
+        used = set(obj.obj.id1 for obj in self.objects.objects.get_type(SBObject.TYPE_MUSIC_TRACK))
+
+        for (mid, new_time) in musics:
+            if mid in used:
+                raise SoundbankError("ID %i already used" % (mid))
+
+            used.add(mid)
+
+        segments = self.objects.objects.get_type(SBObject.TYPE_MUSIC_SEGMENT)
+
+        if not segments:
+            raise SoundbankError("No music segments within the soundbank")
+
+        template = deepcopy(segments[0].obj)
+        template.children = 1
+        template.child_ids = [0]
+        template.unk_double_1 = 1000.0
+        template.unk_field64_1 = 0
+        template.unk_field64_2 = 0
+        template.time_length = 0.0
+        template.time_length_next = 0.0
+        template.sound_structure.parent_id = 0
+
+        body = bytearray(struct.pack("<I", 0) + str(template))
+        child_pos = 4 + len(template.sound_structure) + 4
+        length_pos = child_pos + 4 + SBMusicSegmentObject.TIMING.offset("time_length")
+        next_pos = child_pos + 4 + SBMusicSegmentObject.TIMING.offset("time_length_next")
+
+        ids = self.objects.get_new_ids(len(musics) * 2)
+        added = []
+
+        for (i, (mid, new_time)) in enumerate(musics):
+            (musicTrackID, musicSegmentID) = ids[i * 2:i * 2 + 2]
+
+            musicTrackObject = SBObject()
+            musicTrackObject.type = SBObject.TYPE_MUSIC_TRACK
+            musicTrackObject.id = musicTrackID
+            musicTrackObject.obj = SBMusicTrackCustomObject(mid, new_time, musicSegmentID)
+            musicTrackObject.calculate_length()
+
+            self.objects.objects.append(musicTrackObject)
+
+            struct.pack_into("<I", body, 0, musicSegmentID)
+            struct.pack_into("<I", body, child_pos, musicTrackID)
+            struct.pack_into("<d", body, length_pos, new_time)
+            struct.pack_into("<d", body, next_pos, new_time)
+
+            self.objects.objects.append(SBObject.from_raw(SBObject.TYPE_MUSIC_SEGMENT, musicSegmentID, None, str(body)))
+            added.append((mid, musicSegmentID))
+
+        self.objects.calculate_length()
+
+        return added
+
+    def get_playlist_ids(self, wid):
+        if wid < 1 or wid > 0xFFFFFFFF:
+            raise SoundbankError("Invalid music ID")
+
+        references = self.objects.get_references()
+        tracks = [obj for obj in references.get_media_owners(wid) if obj.type == SBObject.TYPE_MUSIC_TRACK]
+
+        if not tracks:
+            raise SoundbankError("Could not find ID %i within soundbank" % (wid))
+
+        segments = {}
+
+        for track in tracks:
+            for (obj, field) in references.get_referrers(track.id, ("child_ids",)):
+                if obj.type == SBObject.TYPE_MUSIC_SEGMENT:
+                    segments[obj.id] = obj
+
+        if not segments:
+            raise SoundbankError("%i has no music segments" % (wid))
+
+        playlists = {}
+
+        for segid in segments:
+            for (obj, field) in references.get_referrers(segid, ("segment_ids",)):
+                if obj.type == SBObject.TYPE_MUSIC_PLAYLIST:
+                    playlists[obj.id] = obj
+
+        playlist_ids = [("'%i'" % (obj.id)) for obj in references.sort(playlists.itervalues())]
+
+        if not playlist_ids:
+            raise SoundbankError("%i has no music playlists" % (wid))
+
+        print "[*] Playlists found: %i" % len(playlist_ids)
+        print "[*] Playlists IDs: %s" % (", ".join(playlist_ids))
+        print
+
+    @Profile.phase("Export playlist")
+    def export_playlist(self, playlist_id):
+        if playlist_id < 1 or playlist_id > 0xFFFFFFFF:
+            raise SoundbankError("Invalid playlist ID")
+
+        playlist = self.objects.objects.get(playlist_id)
+
+        if playlist is None or playlist.type != SBObject.TYPE_MUSIC_PLAYLIST:
+            raise SoundbankError("Playlist %i not found within soundbank" % (playlist_id))
+
+        playlist_file = "%i_playlist.ini" % (playlist_id)
+
+        with open(playlist_file, "wt") as f:
+            playlist.obj.export(self.objects.objects).write(f)
+
+    @Profile.phase("Export playlists")
+    def export_playlists(self, path):
+        """ Writes every playlist of the soundbank to one JSON document, returns their count. """
+
+        objects = self.objects.objects
+        tracks = dict((obj.id, obj.obj.id1) for obj in reversed(objects.get_type(SBObject.TYPE_MUSIC_TRACK)))
+        segments = {}
+
+        for obj in objects.get_type(SBObject.TYPE_MUSIC_SEGMENT):
+            segments.setdefault(obj.id, [tracks[child] for child in obj.obj.child_ids if child in tracks])
+
+        playlists = []
+
+        for obj in objects.get_type(SBObject.TYPE_MUSIC_PLAYLIST):
+            playlist = OrderedDict(id=obj.id)
+            playlist.update(obj.obj.export_json(segments))
+            playlists.append(playlist)
+
+        document = OrderedDict((("bank", self.header.id), ("playlists", playlists)))
+
+        try:
+            with open(path, "wb") as f:
+                json.dump(document, f, indent=1, separators=(",", ": "))
+        except (OSError, IOError):
+            raise SoundbankError("Could not write playlists")
+
+        return len(playlists)
+
+    @Profile.phase("Reimport playlists")
+    def reimport_playlists(self, path):
+        """ Reimports every playlist of a document written by export_playlists, returns their count. """
+
+        try:
+            with open(path, "rb") as f:
+                document = json.load(f)
+
+            playlists = document["playlists"]
+            ids = [int(playlist["id"]) for playlist in playlists]
+        except (OSError, IOError, ValueError, KeyError, TypeError):
+            raise SoundbankError("Could not read playlists")
+
+        objects = self.objects.objects
+
+        for (playlist_id, data) in zip(ids, playlists):
+            playlist = objects.get(playlist_id)
+
+            if playlist is None or playlist.type != SBObject.TYPE_MUSIC_PLAYLIST:
+                raise SoundbankError("Playlist %i not found within soundbank" % (playlist_id))
+
+            playlistSegids = tuple(playlist.obj.segment_ids)
+
+            try:
+                moveSegments = playlist.obj.reimport_json(data)
+            except SBObjectError:
+                raise SoundbankError("Invalid playlist %i" % (playlist_id))
+
+            playlist.calculate_length()
+
+            if moveSegments:
+                self._move_segments(playlist, playlistSegids, moveSegments)
+
+        self.objects.calculate_length()
+
+        return len(playlists)
+
+    @Profile.phase("Reimport playlist")
+    def reimport_playlist(self, playlist_id):
+        if playlist_id < 1 or playlist_id > 0xFFFFFFFF:
+            raise SoundbankError("Invalid playlist ID")
+
+        objects = self.objects.objects
+        playlist = objects.get(playlist_id)
+
+        if playlist is None or playlist.type != SBObject.TYPE_MUSIC_PLAYLIST:
+            raise SoundbankError("Playlist %i not found within soundbank" % (playlist_id))
+
+        playlistSegids = tuple(playlist.obj.segment_ids)
+        playlist_file = "%i_playlist.ini" % (playlist_id)
+
+        moveSegments = playlist.obj.reimport(playlist_file)
+        playlist.calculate_length()
+
+        if moveSegments:
+            self._move_segments(playlist, playlistSegids, moveSegments)
+
+        self.objects.calculate_length()
+
+    def _move_segments(self, playlist, playlistSegids, moveSegments):
+        """ Moves the given segments found after the playlist, and their tracks, right before it. """
+
+        objects = self.objects.objects
+        playlistSegids = frozenset(playlistSegids).difference(moveSegments)
+        baseSegment = None
+
+        for obj in objects.get_type(SBObject.TYPE_MUSIC_SEGMENT):
+            if obj.id in playlistSegids:
+                baseSegment = obj
+                break
+
+        if baseSegment is None:
+            raise SoundbankError("No base segment within playlist")
+
+        positions = dict((id(obj), i) for (i, obj) in enumerate(objects))
+        tracks = {}
+
+        for obj in objects.get_type(SBObject.TYPE_MUSIC_TRACK):
+            tracks.setdefault(obj.id, []).append(obj)
+
+        # Moved segments are the base segment with their own tracks and timing.
+        base = baseSegment.obj
+        head = str(base.sound_structure)
+        tail = base.unk_data or ""
+        timing = SBMusicSegmentObject.TIMING
+        kept = ("unk_double_1", "unk_field64_1", "unk_field64_2", "time_length", "time_length_next")
+
+        # Every object to move, in the order they end up right before the playlist.
+        moved = OrderedDict()
+
+        for segid in moveSegments:
+            segment = objects.get(segid)
+
+            if segment is None or segment.type != SBObject.TYPE_MUSIC_SEGMENT:
+                raise SoundbankError("Failed to find playlist's music segment within soundbank")
+
+            if positions[id(segment)] < positions[id(playlist)] or id(segment) in moved:
+                continue
+
+            child_ids = segment.obj.child_ids
+            segmentTracks = [track for trackid in set(child_ids) for track in tracks.get(trackid, ())]
+
+            if not segmentTracks:
+                raise SoundbankError("Failed to find tracks for playlist's music segment within soundbank")
+
+            for track in sorted(segmentTracks, key=lambda track: positions[id(track)]):
+                moved.pop(id(track), None)
+                moved[id(track)] = track
+
+            values = [getattr(segment.obj if name in kept else base, name) for name in timing.names]
+            segment.set_raw(struct.pack("<I", segment.id) + head + struct.pack("<I%iI" % (len(child_ids)), segment.obj.children,
+                            *child_ids) + timing.packer.pack(*values) + tail)
+            moved[id(segment)] = segment
+
+        objects.move_before(playlist, moved.values())
+
+    def select_media(self, ids=None, ranges=None, events=None):
+        """ Returns the DIDX positions of the given ids, id ranges and media reached from the given objects. """
+
+        table = self.data_index.data_info
+
+        if not ids and not ranges and not events:
+            return range(len(table))
+
+        wanted = set(ids or ())
+
+        if events:
+            references = self.objects.get_references()
+
+            for id in events:
+                if self.objects.objects.get(id) is None:
+                    raise SoundbankError("Object %i not found within soundbank" % (id))
+
+                wanted.update(references.get_media(id))
+
+        indexes = set(i for i in (table.find(id) for id in wanted) if i is not None)
+
+        for (first, last) in ranges or ():
+            indexes.update(i for (i, id) in enumerate(table.ids) if first <= id <= last)
+
+        return sorted(indexes)
+
+    def _dump_media(self, folder, index):
+        table = self.data_index.data_info
+        path = os.path.join(folder, "%i.wem" % (table.ids[index]))
+
+        try:
+            if os.path.getsize(path) == table.sizes[index] and hash_file(path) == table.digest(index):
+                return False
+        except (OSError, IOError):
+            pass
+
+        with open(path, "wb") as dump:
+            table.write(index, FileWrite(dump, True))
+
+        return True
+
+    @Profile.phase("Dump sounds")
+    def dump_sounds(self, folder, ids=None, ranges=None, events=None, threads=None):
+        """ Writes the selected WEMs into folder, returns (dumped, unchanged). """
+
+        if not self.data_index:
+            raise SoundbankError("Soundbank does not contains embedded files")
+
+        indexes = self.select_media(ids, ranges, events)
+
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass
+
+        pool = multiprocessing.pool.ThreadPool(threads)
+
+        try:
+            dumped = sum(pool.imap_unordered(lambda index: self._dump_media(folder, index), indexes, 16))
+            pool.close()
+        except (OSError, IOError):
+            pool.terminate()
+            raise SoundbankError("Failed to dump sounds")
+        finally:
+            pool.join()
+
+        return (dumped, len(indexes) - dumped)
+
+    @Profile.phase("Build")
+    def build_bnk(self, path=None, output=None, dedupe=False):
+        """ Writes to path, <BNK>.rebuilt by default, or to output. Dedupe writes identical payloads once. """
+
+        if self.isInit:
+            raise SoundbankError("Rebuilding Init.bnk is not yet supported")
+
+        if path is None:
+            path = self._file + ".rebuilt"
+
+        if output is not None:
+            self.file = FileWrite(output, True)
+        else:
+            try:
+                self.file = FileWrite(FileBatch(open(path, "wb")), True)
+            except (OSError, IOError):
+                raise SoundbankError("Could not create new soundbank")
+
+        with Profile.span("Build BKHD") as span:
+            self.file.write_uchar(self.header.head)
+            self.file.write_uint32(self.header.length)
+            self.file.write_uint32(self.header.version)
+            self.file.write_uint32(self.header.id)
+            self.file.write_uint32(self.header.unk_field32_1)
+            self.file.write_uint32(self.header.unk_field32_2)
+
+            if self.header.unk_data is not None:
+                self.file.write_uchar(self.header.unk_data)
+
+            span.size = self.file.where()
+
+        #if self.unk_chunk:
+            #self.file.write_uchar(self.unk_chunk)
+
+        if self.data_index:
+            with Profile.span("Build DIDX") as span:
+                self.data_index.calculate_offsets(dedupe)
+
+                self.file.write_uchar(self.data_index.head)
+                pos = self.file.reserve_uint32()
+
+                self.file.write_uchar(self.data_index.data_info.pack())
+
+                self.data_index.length = self.file.where() - pos - 4
+                self.file.patch_uint32(pos, self.data_index.length)
+
+                span.size = self.data_index.length
+                span.count = len(self.data_index.data_info)
+
+        if self.data:
+            with Profile.span("Build DATA") as span:
+                self.file.write_uchar(self.data.head)
+                pos = self.file.reserve_uint32()
+
+                self.data.offset = self.file.where()
+
+                table = self.data_index.data_info
+
+                for i in table.layout:
+                    table.write(i, self.file)
+
+                self.data.length = self.file.where() - self.data.offset
+                self.file.patch_uint32(pos, self.data.length)
+
+                span.size = self.data.length
+                span.count = len(table.layout)
+
+        with Profile.span("Build HIRC") as span:
+            self._build_objects()
+            span.size = self.objects.length
+            span.count = self.objects.quantity
+
+        if self.stid:
+            with Profile.span("Build STID") as span:
+                self.file.write_uchar(self.stid.head)
+                self.file.write_uint32(self.stid.length)
+                self.file.write_uint32(self.stid.unk_field32_1)
+                self.file.write_uint32(self.stid.quantity)
+                self.file.write_uchar(self.stid.remaining)
+
+                span.size = self.stid.length
+
+        with Profile.span("Build flush"):
+            del self.file
+
+    def verify(self):
+        """ Builds against the original file, returns None or (offset, chunk head, object, changed objects). """
+
+        objects = self.objects.objects
+        changed = [obj for obj in objects if not obj.reencode()]
+
+        # Soundbanks sharing payloads between DIDX entries were built deduplicated.
+        dedupe = bool(self.data_index) and len(set(self.data_index.data_info.origins)) < len(self.data_index.data_info)
+
+        original = FileCompare(self._file)
+        self.build_bnk(output=FileBatch(original), dedupe=dedupe)
+
+        if original.first is None:
+            return None
+
+        offset = original.first
+        head = None
+        obj = changed[0] if changed else None
+
+        for (chunk, start, end) in original.chunks():
+            if start <= offset < end:
+                head = chunk
+                break
+
+        if obj is None and head == SBObjects.HEAD:
+            i = bisect_right([item.offset - 5 for item in objects], offset) - 1
+
+            if i >= 0:
+                obj = objects[i]
+
+        return (offset, head, obj, changed)
+
+    def _build_objects(self):
+        self.objects.quantity = len(self.objects.objects)
+
+        self.file.write_uchar(self.objects.head)
+        pos = self.file.reserve_uint32()
+        self.file.write_uint32(self.objects.quantity)
+
+        profile = Profile.enabled
+
+        for obj in self.objects.objects:
+            if profile:
+                start = Profile.clock()
+
+            if obj.type == SBObject.TYPE_SOUND and self.data_index:
+                embedded = SBSoundObject.peek_embedded(obj)
+
+                if embedded is not None:
+                    (audio_id, old_offset, old_size) = embedded
+                    i = self.data_index.data_info.find(audio_id)
+
+                    if i is not None:
+                        offset = self.data.offset + self.data_index.data_info.offsets[i]
+                        size = self.data_index.data_info.sizes[i]
+
+                        if (offset, size) != (old_offset, old_size):
+                            obj.obj.offset = offset
+                            obj.obj.size = size
+
+            obj.write(self.file)
+
+            if profile:
+                Profile.add("Write " + SBObject.type_name(obj.type), Profile.clock() - start, 5 + obj.length, 1)
+
+        self.objects.length = self.file.where() - pos - 4
+        self.file.patch_uint32(pos, self.objects.length)
+
+class SBShell(cmd.Cmd):
+    """ Keeps soundbanks loaded between commands, evicting the least recently used over the budget. """
+
+    BUDGET = 512
+    HIRC_FACTOR = 8 # Rough size of decoded HIRC objects relative to their raw size.
+
+    intro = "Type help for the list of commands."
+    prompt = "(soundbank) "
+
+    def __init__(self, budget=BUDGET):
+        cmd.Cmd.__init__(self)
+        self.budget = budget * 0x100000
+        self.banks = OrderedDict()
+        self.current = None
+
+    def precmd(self, line):
+        (command, sep, args) = line.partition(" ")
+
+        return command.replace("-", "_") + sep + args
+
+    def onecmd(self, line):
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except (SoundbankError, SyntaxError, ValueError, EnvironmentError, struct.error) as e:
+            print e
+
+    def emptyline(self):
+        pass
+
+    def _load(self, path):
+        path = os.path.abspath(path)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise SoundbankError("Could not open soundbank")
+
+        stamp = (stat.st_size, stat.st_mtime)
+        entry = self.banks.pop(path, None)
+
+        if entry is None or entry[1] != stamp:
+            soundbank = Soundbank(path, True)
+            soundbank.read()
+            entry = (soundbank, stamp, stat.st_size + soundbank.objects.length * SBShell.HIRC_FACTOR)
+
+        self.banks[path] = entry
+        self.current = path
+        self._evict()
+
+        return entry[0]
+
+    def _evict(self):
+        total = sum(cost for (soundbank, stamp, cost) in self.banks.itervalues())
+
+        while total > self.budget and len(self.banks) > 1:
+            (path, (soundbank, stamp, cost)) = self.banks.popitem(last=False)
+            total -= cost
+
+            print "[*] Unloaded %s" % (path)
+
+    def _bank(self):
+        if self.current is None:
+            raise SoundbankError("No soundbank loaded")
+
+        return self._load(self.current)
+
+    @staticmethod
+    def _id(arg):
+        try:
+            return int(arg)
+        except ValueError:
+            raise SyntaxError("ID is not an integer")
+
+    def do_load(self, arg):
+        """load <BNK> [BNK ...]: loads soundbanks, the last one becomes current."""
+
+        paths = shlex.split(arg)
 
-        print "--- OBJECTS ---"
-        print "HEAD: " + self.objects.head
-        print "LENGTH: %i" % (self.objects.length)
-        print "QUANTITY: %i" % (self.objects.quantity)
+        if not paths:
+            raise SyntaxError("Usage: load <BNK> [BNK ...]")
 
-        objTypes = {}
+        for path in paths:
+            soundbank = self._load(path)
+            print "[*] %s: %i objects" % (self.current, len(soundbank.objects.objects))
 
-        for obj in self.objects.objects:
+    def do_use(self, arg):
+        """use <BNK>: makes a soundbank current, loading it if needed."""
+
+        self.do_load(arg)
+
+    def do_banks(self, arg):
+        """banks: lists the loaded soundbanks, least recently used first."""
+
+        for (path, (soundbank, stamp, cost)) in self.banks.iteritems():
+            print "%s %s (%.1f MB)" % ("*" if path == self.current else " ", path, cost / float(0x100000))
+
+    def do_budget(self, arg):
+        """budget [MB]: shows or sets the memory budget of loaded soundbanks."""
+
+        if arg:
             try:
-                objTypes[obj.type] += 1
-            except KeyError:
-                objTypes[obj.type] = 1
+                budget = int(arg)
+            except ValueError:
+                raise SyntaxError("Budget is not an integer")
 
-        for (key, value) in objTypes.iteritems():
-            print "TYPE %i: %i" % (key, value)
+            if budget < 1:
+                raise SyntaxError("Invalid budget")
 
-        print "--- OBJECTS ---"
-        print
+            self.budget = budget * 0x100000
+            self._evict()
 
-        if not self.isInit:
-            if self.stid:
-                print "--- SOUND TYPE ID ---"
-                print "HEAD: " + self.stid.head
-                print "LENGTH: %i" % (self.stid.length)
-                print "UNK FIELD32 1: %i" % (self.stid.unk_field32_1)
-                print "QUANTITY: %i" % (self.stid.quantity)
-                print "REMAINING SIZE: %i" % (len(self.stid.remaining))
-                print "--- SOUND TYPE ID ---"
-                print
+        print "[*] Budget: %i MB" % (self.budget / 0x100000)
 
-        else:
-                print "--- ENVIRONMENTS ---"
-                print "HEAD: " + self.envs.head
-                print "LENGTH: %i" % (self.envs.length)
-                print "UNK DATA LENGTH: %i" % (len(self.envs.unk_data))
-                print "--- ENVIRONMENTS ---"
-                print
+    def do_debug(self, arg):
+        """debug: shows the chunks of the current soundbank."""
 
-    def debug_event(self, event_id):
-        for event in self.objects.objects:
-            if event.id == event_id:
-                if event.type == SBObject.TYPE_EVENT:
-                    print "Event Object ID: %i" % (event.id)
-                    print "Event Actions: %i" % (event.obj.event_actions)
-                    print
+        self._bank().debug()
 
-                    for (i, action_id) in enumerate(event.obj.event_action_ids, 1):
-                        print "*** EVENT ACTION %03i ***" % (i)
-                        self.debug_event(action_id)
-                        print
-
-                    return
-                elif event.type == SBObject.TYPE_EVENT_ACTION:
-                    print "Event Action Object ID: %i" % (event.id)
-                    print "Event Action Scope: %i" % (event.obj.scope)
-                    print "Event Action Type: %i" % (event.obj.type)
-                    print "Event Action Game Object ID: %i" % (event.obj.game_object_id)
-                    print "UNK FIELD 8 1: %i" % (event.obj.unk_field8_1)
-                    print "Event Action Additional Parameters Count: %i" % (event.obj.additional_parameters_count)
-                    print ("Event Action Additional Parameters: %s" %
-                        (", ".join(
-                            "(%i: %.3f)" % (additional_parameter.type, additional_parameter.value)
-                            if additional_parameter.type == 0x10 else
-                            "(%i: %i)" % (additional_parameter.type, additional_parameter.value)
-                            for additional_parameter in event.obj.additional_parameters
-                        ))
-                    )
-                    print "UNK FIELD 8 2: %i" % (event.obj.unk_field8_2)
-
-                    if event.obj.type == SBEventActionObject.ACTION_TYPE_SET_STATE:
-                        print "Event Action State Group ID: %i" % (event.obj.state_group_id)
-                        print "Event Action State ID: %i" % (event.obj.state_id)
-                    elif event.obj.type == SBEventActionObject.ACTION_TYPE_SET_SWITCH:
-                        print "Event Action Switch Group ID: %i" % (event.obj.switch_group_id)
-                        print "Event Action Switch ID: %i" % (event.obj.switch_id)
-                    #elif event.obj.type == 0x01:
-                        #print "UNK FIELD 32 1: %i" % (event.obj.unk_field32_1)
-                        #print "UNK FIELD 16 1: %i" % (event.obj.unk_field16_1)
-                        #print "UNK FIELD 32 2: %i" % (event.obj.unk_field32_2)
-                    #elif event.obj.type == 0x04:
-                        #print "UNK FIELD 32 1: %i" % (event.obj.unk_field32_1)
-                        #print "UNK FIELD 8 3: %i" % (event.obj.unk_field8_3)
-
-                    if event.obj.unk_data is not None:
-                        print "UNK DATA: %s" % (hexlify(event.obj.unk_data).upper())
-
-                    print "---------- SOUND ----------"
-                    self.debug_sound(event.obj.game_object_id)
-                    print "---------- SOUND ----------"
-
-                    return
-                else:
-                    break
+    def do_debug_event(self, arg):
+        """debug-event <EVENT ID>"""
 
-        print "No event object by ID %i." % (event_id)
+        self._bank().debug_event(self._id(arg))
 
-    def debug_sound(self, sound_id):
-        for sound in self.objects.objects:
-            if sound.id == sound_id:
-                if sound.type == SBObject.TYPE_SOUND:
-                    print "Sound Object ID: %i" % (sound.id)
-                    print "UNK FIELD 32 1: %i" % (sound.obj.unk_field32_1)
-                    print "Sound Include Type: %i" % (sound.obj.include_type)
-                    print "Sound Audio ID: %i" % (sound.obj.audio_id)
-                    print "Sound Source ID: %i" % (sound.obj.source_id)
-
-                    if sound.obj.include_type == SBSoundObject.SOUND_EMBEDDED:
-                        print "Sound Offset: %i" % (sound.obj.offset)
-                        print "Sound Size: %i" % (sound.obj.size)
-
-                    print "Sound Type: %i" % (sound.obj.sound_type)
-                    print "Sound Structure: %s" % (hexlify(sound.obj.sound_structure).upper())
-
-                    return
-                else:
-                    break
+    def do_debug_sound(self, arg):
+        """debug-sound <SOUND ID>"""
 
-        print "No sound object by ID %i." % (sound_id)
+        self._bank().debug_sound(self._id(arg))
 
-    def debug_object(self, object_id):
-        for object in self.objects.objects:
-            if object.id == object_id:
-                print "Object ID: %i" % (object.id)
-                print "Object Type: %i" % (object.type)
-                print "Object Size: %i" % (len(str(object.obj)))
-                print "Object Data: %s" % (hexlify(str(object.obj)).upper())
+    def do_debug_object(self, arg):
+        """debug-object <OBJECT ID>"""
 
-                return
+        self._bank().debug_object(self._id(arg))
 
-        print "No object by ID %i." % (object_id)
+    def do_debug_owner(self, arg):
+        """debug-owner <AUDIO ID>"""
 
-    def debug_owner(self, audio_id):
-        for owner in self.objects.objects:
-            if owner.type == SBObject.TYPE_SOUND:
-                if owner.obj.audio_id == audio_id:
-                    print "Object Owner ID: %i" % (owner.id)
-                    print "Object Owner Type: SOUND"
+        self._bank().debug_owner(self._id(arg))
 
-                    return
-            elif owner.type == SBObject.TYPE_MUSIC_TRACK:
-                if owner.obj.id1 == audio_id:
-                    print "Object Owner ID: %i" % (owner.id)
-                    print "Object Owner Type: MUSIC"
+    def do_debug_references(self, arg):
+        """debug-references <ID>"""
 
-                    return
+        self._bank().debug_references(self._id(arg))
 
-        print "No object owner found for audio ID %i." % (audio_id)
+    def do_playlist_id_from_track(self, arg):
+        """playlist-id-from-track <TRACK ID>"""
 
-    def read_wems(self, folder):
-        try:
-            for file in os.listdir(folder):
-                if not os.path.isfile(folder + os.sep + file) or not file.endswith(".wem"):
-                    raise SoundbankError("%s is not a WEM file" % (file))
+        self._bank().get_playlist_ids(self._id(arg))
 
-                path = folder + os.sep + file
+    def do_export_playlist(self, arg):
+        """export-playlist <PLAYLIST ID>: writes <PLAYLIST ID>_playlist.ini."""
 
-                wem = WEM()
-                wem.id = int(file[:-4])
-                wem.size = os.path.getsize(path)
+        self._bank().export_playlist(self._id(arg))
 
-                with open(path, "rb") as f:
-                    wem.data = f.read()
+    def do_rebuild(self, arg):
+        """rebuild <FOLDER>: replaces WEMs of the current soundbank from FOLDER into <BNK>.rebuilt."""
 
-                self.to_add.append(wem)
+        if not arg:
+            raise SyntaxError("Usage: rebuild <FOLDER>")
 
-        except (OSError, IOError, ValueError):
-            raise SoundbankError("Failed to load new WEMs")
+        if self.current is None:
+            raise SoundbankError("No soundbank loaded")
 
-    def rebuild_data(self):
-        for data_info in self.data_index.data_info:
-            for wem in self.to_add:
-                if data_info.id == wem.id:
-                    data_info.size = wem.size
-                    data_info.data = wem.data
-                    break
+        # Rebuilding changes the soundbank, so the loaded one is left alone.
+        soundbank = Soundbank(self.current, True)
+        soundbank.read()
 
-    def rebuild_music(self, wem):
-        mid = int(os.path.basename(wem)[:-4])
+        if not soundbank.data_index:
+            raise SoundbankError("Soundbank does not contains embedded files")
 
-        if mid < 1 or mid > 0xFFFFFFFF:
-            raise SoundbankError("Invalid WEM ID")
+        soundbank.read_wems(arg)
+        soundbank.rebuild_data()
+        soundbank.build_bnk()
 
-        _wem = compare_wem.WEM(wem)
-        _wem.read()
+        print "[*] Written %s.rebuilt" % (self.current)
 
-        new_time = (_wem.sample_count / float(_wem.sample_rate)) * 1000
+    def do_quit(self, arg):
+        """quit: leaves the shell."""
 
-        del _wem
+        return True
 
-        trackids = {}
+    do_exit = do_quit
 
-        for (i, obj) in enumerate(self.objects.objects):
-            if obj.type == SBObject.TYPE_MUSIC_TRACK:
-                if obj.obj.id1 == mid:
-                    trackids[obj.id] = [i, None]
+    def do_EOF(self, arg):
+        """EOF: leaves the shell."""
 
-        if not trackids:
-            raise SoundbankError("Could not find ID %i within soundbank" % (mid))
+        print
 
-        for obj in self.objects.objects:
-            if obj.type == SBObject.TYPE_MUSIC_SEGMENT:
-                if len(obj.obj.child_ids) == 1:
-                    if obj.obj.child_ids[0] in trackids:
-                        obj.obj.unk_double_1 = 1000.0
-                        obj.obj.unk_field64_1 = 0
-                        obj.obj.unk_field64_2 = 0
-                        obj.obj.time_length = new_time
-                        obj.obj.time_length_next = new_time
-                        trackids[obj.obj.child_ids[0]][1] = obj.id
-                else:
-                    hasTrack = [trackid for trackid in trackids if trackid in obj.obj.child_ids]
-
-                    if hasTrack:
-                        trackid = hasTrack[0]
-
-                        obj.obj.children = 1
-                        obj.obj.child_ids = [trackid]
-                        obj.obj.unk_double_1 = 1000.0
-                        obj.obj.unk_field64_1 = 0
-                        obj.obj.unk_field64_2 = 0
-                        obj.obj.time_length = new_time
-                        obj.obj.time_length_next = new_time
-                        obj.calculate_length()
-                        trackids[trackid][1] = obj.id
-
-        for (trackidx, segid) in trackids.itervalues():
-            if segid is not None:
-                self.objects.objects[trackidx].obj = SBMusicTrackCustomObject(mid, new_time, segid)
-                self.objects.objects[trackidx].calculate_length()
+        return True
 
-        self.objects.calculate_length()
+def read_manifest(manifest):
+    jobs = []
 
-    def add_music(self, wem):
-        mid = int(os.path.basename(wem)[:-4])
+    try:
+        with open(manifest, "rb") as f:
+            for row in csv.reader(f):
+                if not row or row[0].strip().startswith("#"):
+                    continue
 
-        if mid < 1 or mid > 0xFFFFFFFF:
-            raise SoundbankError("Invalid WEM ID")
+                if len(row) != 2:
+                    raise SoundbankError("Invalid manifest row: %s" % (", ".join(row)))
 
-        _wem = compare_wem.WEM(wem)
-        _wem.read()
+                jobs.append((row[0].strip(), row[1].strip(), None))
+    except (OSError, IOError, csv.Error):
+        raise SoundbankError("Failed to read manifest")
 
-        new_time = (_wem.sample_count / float(_wem.sample_rate)) * 1000
+    return jobs
 
-        del _wem
+def find_wems(paths):
+    """ Expands WEM folders of paths into their sorted WEM files. """
 
-        segment = None
+    wems = []
 
-        for obj in self.objects.objects:
-            if obj.type == SBObject.TYPE_MUSIC_TRACK:
-                if obj.obj.id1 == mid:
-                    raise SoundbankError("ID %i already used" % (mid))
-            elif obj.type == SBObject.TYPE_MUSIC_SEGMENT:
-                if segment is None:
-                    segment = obj
-
-        if segment is None:
-            raise SoundbankError("No music segments within the soundbank")
+    try:
+        for path in paths:
+            if os.path.isdir(path):
+                wems += [os.path.join(path, file) for file in sorted(os.listdir(path)) if file.lower().endswith(".wem")]
+            else:
+                wems.append(path)
+    except (OSError, IOError):
+        raise SoundbankError("Failed to list WEM folder")
 
-        musicTrackID = self.objects.get_new_id()
-        musicTrackObject = SBObject()
-        musicTrackObject.type = SBObject.TYPE_MUSIC_TRACK
-        musicTrackObject.id = musicTrackID
-        musicTrackObject.obj = SBMusicTrackCustomObject(mid, new_time, 0)
-        musicTrackObject.calculate_length()
+    if not wems:
+        raise SoundbankError("No WEM files found")
 
-        self.objects.objects.append(musicTrackObject)
+    return wems
 
-        musicSegmentID = self.objects.get_new_id()
-        musicTrackObject.obj.parent = musicSegmentID
+def find_jobs(bnk_folder, wem_folder):
+    try:
+        if WEMStore.is_store(wem_folder):
+            ids = frozenset(id for rows in WEMStore(wem_folder).read_manifest().itervalues() for (id, size, digest) in rows)
+        else:
+            ids = set()
 
-        musicSegmentObject = deepcopy(segment)
-        musicSegmentObject.id = musicSegmentID
-        musicSegmentObject.obj.children = 1
-        musicSegmentObject.obj.child_ids = [musicTrackID]
-        musicSegmentObject.obj.unk_double_1 = 1000.0
-        musicSegmentObject.obj.unk_field64_1 = 0
-        musicSegmentObject.obj.unk_field64_2 = 0
-        musicSegmentObject.obj.time_length = new_time
-        musicSegmentObject.obj.time_length_next = new_time
-        musicSegmentObject.obj.sound_structure.parent_id = 0
-        musicSegmentObject.calculate_length()
+            for file in sorted(os.listdir(wem_folder)):
+                if not file.endswith(".wem"):
+                    continue
 
-        self.objects.objects.append(musicSegmentObject)
+                try:
+                    ids.add(int(file[:-4]))
+                except ValueError:
+                    print "[SKIPPED] %s: not a numeric WEM ID" % (os.path.join(wem_folder, file))
 
-        self.objects.calculate_length()
+            ids = frozenset(ids)
 
-        return musicSegmentID
+        bnks = sorted(file for file in os.listdir(bnk_folder) if file.lower().endswith(".bnk"))
+    except (OSError, IOError, ValueError):
+        raise SoundbankError("Failed to list batch folders")
 
-    def get_playlist_ids(self, wid):
-        if wid < 1 or wid > 0xFFFFFFFF:
-            raise SoundbankError("Invalid music ID")
+    return [(os.path.join(bnk_folder, bnk), wem_folder, ids) for bnk in bnks]
 
-        trackids = []
+def rebuild_job(job):
+    """ Pool worker: rebuilds one soundbank, returns (bnk, status, seconds, message). """
 
-        for obj in self.objects.objects:
-            if obj.type == SBObject.TYPE_MUSIC_TRACK:
-                if obj.obj.id1 == wid:
-                    trackids.append(obj.id)
+    (bnk, folder, ids, dedupe) = job
+    start = time.time()
 
-        if not trackids:
-            raise SoundbankError("Could not find ID %i within soundbank" % (wid))
+    try:
+        soundbank = Soundbank(bnk)
+        soundbank.read()
 
-        segids = []
+        if not soundbank.data_index or soundbank.isInit:
+            if ids is not None:
+                return (bnk, "SKIPPED", time.time() - start, "no embedded files")
 
-        for obj in self.objects.objects:
-            if obj.type == SBObject.TYPE_MUSIC_SEGMENT:
-                hasTrack = [trackid for trackid in trackids if trackid in obj.obj.child_ids]
+            raise SoundbankError("Soundbank does not contains embedded files")
 
-                if hasTrack:
-                    segids.append(obj.id)
+        if ids is not None and ids.isdisjoint(soundbank.data_index.data_info.ids):
+            return (bnk, "SKIPPED", time.time() - start, "no matching WEMs")
 
-        if not segids:
-            raise SoundbankError("%i has no music segments" % (wid))
+        soundbank.read_wems(folder, ids is None)
 
-        playlist_ids = []
+        if ids is not None and not soundbank.to_add:
+            return (bnk, "SKIPPED", time.time() - start, "no changed WEMs")
 
-        for obj in self.objects.objects:
-            if obj.type == SBObject.TYPE_MUSIC_PLAYLIST:
-                hasSegment = [segid for segid in segids if segid in obj.obj.segment_ids]
+        soundbank.rebuild_data()
+        soundbank.build_bnk(dedupe=dedupe)
+    except Exception as e:
+        return (bnk, "FAILED", time.time() - start, "%s: %s" % (type(e).__name__, e))
 
-                if hasSegment:
-                    playlist_ids.append(("'%i'" % (obj.id)))
+    return (bnk, "OK", time.time() - start, "")
 
-        if not playlist_ids:
-            raise SoundbankError("%i has no music playlists" % (wid))
+def run_jobs(function, jobs, processes, callback):
+    """ Runs function over jobs in a process pool, returns {status: count} of what callback returns per result. """
 
-        print "[*] Playlists found: %i" % len(playlist_ids)
-        print "[*] Playlists IDs: %s" % (", ".join(playlist_ids))
-        print
+    results = {}
+    pool = multiprocessing.Pool(processes)
 
-    def export_playlist(self, playlist_id):
-        if playlist_id < 1 or playlist_id > 0xFFFFFFFF:
-            raise SoundbankError("Invalid playlist ID")
+    try:
+        for result in pool.imap_unordered(function, jobs):
+            status = callback(result)
+            results[status] = results.get(status, 0) + 1
 
-        playlist = None
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
-        for obj in self.objects.objects:
-            if obj.type == SBObject.TYPE_MUSIC_PLAYLIST:
-                if obj.id == playlist_id:
-                    playlist = obj
-                    break
+    return results
 
-        if playlist is None:
-            raise SoundbankError("Playlist %i not found within soundbank" % (playlist_id))
+def print_job(result):
+    (path, status, elapsed, message) = result
 
-        playlist_file = "%i_playlist.ini" % (playlist_id)
+    if message:
+        print "[%s] %s (%.3fs): %s" % (status, path, elapsed, message)
+    else:
+        print "[%s] %s (%.3fs)" % (status, path, elapsed)
 
-        with open(playlist_file, "wt") as f:
-            playlist.obj.export(self.objects.objects).write(f)
+    return status
 
-    def reimport_playlist(self, playlist_id):
-        if playlist_id < 1 or playlist_id > 0xFFFFFFFF:
-            raise SoundbankError("Invalid playlist ID")
+def batch_rebuild(jobs, processes=None, dedupe=False):
+    start = time.time()
+    jobs = ((bnk, folder, ids, dedupe) for (bnk, folder, ids) in jobs)
+    results = run_jobs(rebuild_job, jobs, processes, print_job)
 
-        playlist = None
-        playlistIdx = None
-        playlistSegids = None
+    print
+    print "[*] Rebuilt: %i, Failed: %i, Skipped: %i (%.3fs)" % (results.get("OK", 0), results.get("FAILED", 0),
+        results.get("SKIPPED", 0), time.time() - start)
 
-        for (i, obj) in enumerate(self.objects.objects):
-            if obj.type == SBObject.TYPE_MUSIC_PLAYLIST:
-                if obj.id == playlist_id:
-                    playlist = obj
-                    playlistIdx = i
-                    playlistSegids = tuple(playlist.obj.segment_ids)
-                    break
+    return not results.get("FAILED")
 
-        if playlist is None:
-            raise SoundbankError("Playlist %i not found within soundbank" % (playlist_id))
+def verify_job(path):
+    """ Pool worker: round-trips one soundbank in memory, returns (path, status, seconds, message). """
 
-        playlist_file = "%i_playlist.ini" % (playlist_id)
+    start = time.time()
 
-        moveSegments = playlist.obj.reimport(playlist_file)
-        playlist.calculate_length()
+    try:
+        soundbank = Soundbank(path)
+        soundbank.read()
 
-        if moveSegments:
-            baseSegment = None
+        if soundbank.isInit:
+            return (path, "SKIPPED", time.time() - start, "rebuilding Init.bnk is not supported")
 
-            for obj in self.objects.objects:
-                if obj.type == SBObject.TYPE_MUSIC_SEGMENT:
-                    if obj.id in playlistSegids and obj.id not in moveSegments:
-                        baseSegment = obj
-                        break
+        result = soundbank.verify()
+    except Exception as e:
+        return (path, "FAILED", time.time() - start, "%s: %s" % (type(e).__name__, e))
 
-            if baseSegment is None:
-                raise SoundbankError("No base segment within playlist")
+    if result is None:
+        return (path, "OK", time.time() - start, "")
 
-            for segid in moveSegments:
-                segment = None
+    (offset, head, obj, changed) = result
+    message = "first difference at 0x%X in %s" % (offset, head or "no chunk")
 
-                for (i, obj) in enumerate(self.objects.objects):
-                    if obj.type == SBObject.TYPE_MUSIC_SEGMENT:
-                        if obj.id == segid:
-                            segment = obj
-                            segmentIdx = i
-                            break
+    if obj is not None:
+        message += ", object %i (%s) at 0x%X" % (obj.id, SBObject.type_name(obj.type), obj.offset - 5)
 
-                if segment is None:
-                    raise SoundbankError("Failed to find playlist's music segment within soundbank")
+    if changed:
+        message += "; %i objects re-encode differently" % (len(changed))
 
-                if segmentIdx < playlistIdx:
-                    continue
+    return (path, "DIVERGED", time.time() - start, message)
 
-                _segment = deepcopy(baseSegment)
-                _segment.id = segment.id
-                _segment.obj.children = segment.obj.children
-                _segment.obj.child_ids = segment.obj.child_ids
-                _segment.obj.unk_double_1 = segment.obj.unk_double_1
-                _segment.obj.unk_field64_1 = segment.obj.unk_field64_1
-                _segment.obj.unk_field64_2 = segment.obj.unk_field64_2
-                _segment.obj.time_length = segment.obj.time_length
-                _segment.obj.time_length_next = segment.obj.time_length_next
-                _segment.calculate_length()
-                segment = _segment
+def batch_verify(paths, processes=None):
+    start = time.time()
+    results = run_jobs(verify_job, paths, processes, print_job)
 
-                tracks = [i for (i, obj) in enumerate(self.objects.objects) if obj.type == SBObject.TYPE_MUSIC_TRACK and obj.id in segment.child_ids]
+    print
+    print "[*] Identical: %i, Diverged: %i, Failed: %i, Skipped: %i (%.3fs)" % (results.get("OK", 0), results.get("DIVERGED", 0),
+        results.get("FAILED", 0), results.get("SKIPPED", 0), time.time() - start)
 
-                if not tracks:
-                    raise SoundbankError("Failed to find tracks for playlist's music segment within soundbank")
+    return not results.get("DIVERGED") and not results.get("FAILED")
 
-                for trackIdx in tracks:
-                    track = self.objects.objects[trackIdx]
-                    del self.objects.objects[trackIdx]
-                    self.objects.objects.insert(playlistIdx, track)
+def hash_file(path):
+    digest = sha1()
 
-                    playlistIdx += 1
+    with open(path, "rb") as f:
+        chunk = f.read(WEM.COPY_SIZE)
 
-                del self.objects.objects[segmentIdx]
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(WEM.COPY_SIZE)
 
-                self.objects.objects.insert(playlistIdx, segment)
+    return digest.digest()
 
-                playlistIdx += 1
+def parse_media_filters(args):
+    """ Splits <ID>, <FIRST>-<LAST> and event:<ID> arguments into (ids, ranges, events). """
 
-        self.objects.calculate_length()
+    ids = set()
+    ranges = []
+    events = []
 
-    def dump_sounds(self, folder):
+    for arg in args:
         try:
-            os.makedirs(folder)
-        except OSError:
-            pass
+            if arg.lower().startswith("event:"):
+                events.append(int(arg[6:]))
+            elif "-" in arg:
+                (first, last) = arg.split("-", 1)
+                ranges.append((int(first), int(last)))
+            else:
+                ids.add(int(arg))
+        except ValueError:
+            raise SyntaxError("Invalid filter %s" % (arg))
 
-        for data_info in self.data_index.data_info:
-            with open(folder + "\\" + str(data_info.id) + ".wem", "wb") as dump:
-                dump.write(data_info.data)
+    return (ids, ranges, events)
 
-    def build_bnk(self):
-        if self.isInit:
-            raise SoundbankError("Rebuilding Init.bnk is not yet supported")
+def store_job(job):
+    """ Pool worker: stores the payloads of one soundbank, returns (path, status, seconds, rows, added sizes, message). """
 
-        try:
-            self.file = FileWrite(self._file + ".rebuilt")
-        except (OSError, IOError):
-            raise SoundbankError("Could not create new soundbank")
+    (path, folder) = job
+    start = time.time()
 
-        self.file.write_uchar(self.header.head)
-        self.file.write_uint32(self.header.length)
-        self.file.write_uint32(self.header.version)
-        self.file.write_uint32(self.header.id)
-        self.file.write_uint32(self.header.unk_field32_1)
-        self.file.write_uint32(self.header.unk_field32_2)
+    try:
+        soundbank = Soundbank(path)
+        soundbank.read(True)
 
-        if self.header.unk_data is not None:
-            self.file.write_uchar(self.header.unk_data)
+        if not soundbank.data_index:
+            return (path, "SKIPPED", time.time() - start, None, None, "no embedded files")
 
-        #if self.unk_chunk:
-            #self.file.write_uchar(self.unk_chunk)
+        store = WEMStore(folder)
+        table = soundbank.data_index.data_info
+        rows = []
+        added = []
 
-        if self.data_index:
-            self.data_index.calculate_offsets()
+        for i in xrange(len(table)):
+            digest = hexlify(table.digest(i))
+            rows.append((table.ids[i], table.sizes[i], digest))
 
-            self.file.write_uchar(self.data_index.head)
-            self.file.write_uint32(self.data_index.length)
+            if store.put(digest, table, i):
+                added.append(table.sizes[i])
+    except Exception as e:
+        return (path, "FAILED", time.time() - start, None, None, "%s: %s" % (type(e).__name__, e))
 
-            for data_info in self.data_index.data_info:
-                self.file.write_uint32(data_info.id)
-                self.file.write_uint32(data_info.offset)
-                self.file.write_uint32(data_info.size)
+    return (path, "OK", time.time() - start, rows, added, "")
 
-        if self.data:
-            self.file.write_uchar(self.data.head)
-            self.file.write_uint32(self.data_index.get_total_size())
+def find_banks(folder):
+    banks = []
 
-            self.data.offset = self.file.where()
+    for (root, dirs, files) in os.walk(folder):
+        dirs.sort()
+        banks += [os.path.join(root, file) for file in sorted(files) if file.lower().endswith(".bnk")]
 
-            for data_info in self.data_index.data_info:
-                self.file.write_uchar(data_info.data)
+    return banks
 
-        self.file.write_uchar(self.objects.head)
-        self.file.write_uint32(self.objects.length)
-        self.file.write_uint32(self.objects.quantity)
+def index_job(path):
+    """ Pool worker: parses one soundbank for SBCorpus, returns (path, size, mtime, rows, seconds, message). """
 
-        for obj in self.objects.objects:
-            self.file.write_uchar(obj.type)
-            self.file.write_uint32(obj.length)
-            self.file.write_uint32(obj.id)
-
-            if obj.type == SBObject.TYPE_SOUND:
-                if obj.obj.include_type == SBSoundObject.SOUND_EMBEDDED and self.data_index:
-                    try:
-                        offset = self.data.offset + self.data_index.get_offset(obj.obj.audio_id)
-                        size = self.data_index.get_size(obj.obj.audio_id)
-                    except TypeError:
-                        pass
-                    else:
-                        obj.obj.offset = offset
-                        obj.obj.size = size
+    start = time.time()
+    stat = os.stat(path)
 
-            self.file.write_uchar(str(obj.obj))
+    try:
+        soundbank = Soundbank(path)
+        soundbank.read()
 
-        if self.stid:
-            self.file.write_uchar(self.stid.head)
-            self.file.write_uint32(self.stid.length)
-            self.file.write_uint32(self.stid.unk_field32_1)
-            self.file.write_uint32(self.stid.quantity)
-            self.file.write_uchar(self.stid.remaining)
+        objects = [(obj.id, obj.type) for obj in soundbank.objects.objects]
+        refs = [(obj.id, obj.type, field, id) for obj in soundbank.objects.objects for (field, id) in SBReferences.get_fields(obj)]
+        media = []
 
-        del self.file
+        if soundbank.data_index:
+            table = soundbank.data_index.data_info
+            media = zip(table.ids, table.offsets, table.sizes)
+
+        rows = (soundbank.header.id, objects, refs, media)
+    except Exception as e:
+        return (path, stat.st_size, stat.st_mtime, None, time.time() - start, "%s: %s" % (type(e).__name__, e))
+
+    return (path, stat.st_size, stat.st_mtime, rows, time.time() - start, "")
 
 def show_usage(path):
     path = os.path.basename(path)
 
     print "Usage: %s <BNK> <FOLDER>" % (path)
-    print "Usage: %s --music <BNK> <WEM>" % (path)
-    print "Usage: %s --add-new-music <BNK> <WEM>" % (path)
-    print "Usage: %s --playlist-id-from-track <BNK> <TRACK ID>" % (path)
+    print "Usage: %s --patch <BNK> <FOLDER>" % (path)
+    print "Usage: %s --batch <MANIFEST> [PROCESSES]" % (path)
+    print "Usage: %s --batch-folder <BNK FOLDER> <WEM FOLDER> [PROCESSES]" % (path)
+    print "Usage: %s --music <BNK> <WEM|WEM FOLDER> [WEM|WEM FOLDER ...]" % (path)
+    print "Usage: %s --add-new-music <BNK> <WEM|WEM FOLDER> [WEM|WEM FOLDER ...]" % (path)
+    print "Usage: %s --index <BNK FOLDER> <DB> [PROCESSES]" % (path)
+    print "Usage: %s --find <DB> <ID>" % (path)
+    print "Usage: %s --shell [BUDGET MB]" % (path)
+    print "Usage: %s --verify <BNK|BNK FOLDER> [PROCESSES]" % (path)
+    print "Usage: %s --store <BNK FOLDER> <STORE> [PROCESSES]" % (path)
+    print "Usage: %s --playlist-id-from-track <BNK|DB> <TRACK ID>" % (path)
     print "Usage: %s --export-playlist <BNK> <PLAYLIST ID>" % (path)
     print "Usage: %s --reimport-playlist <BNK> <PLAYLIST ID>" % (path)
-    print "Usage: %s --dump-sounds <BNK> <FOLDER>" % (path)
+    print "Usage: %s --export-playlists <BNK> <JSON>" % (path)
+    print "Usage: %s --reimport-playlists <BNK> <JSON>" % (path)
+    print "Usage: %s --dump-sounds <BNK> <FOLDER> [ID|FIRST-LAST|event:EVENT ID ...]" % (path)
     print "Usage: %s --debug <BNK>" % (path)
     print "Usage: %s --debug-event <BNK> <EVENT ID>" % (path)
     print "Usage: %s --debug-sound <BNK> <SOUND ID>" % (path)
     print "Usage: %s --debug-object <BNK> <OBJECT ID>" % (path)
-    print "Usage: %s --debug-owner <BNK> <AUDIO ID>" % (path)
+    print "Usage: %s --debug-owner <BNK|DB> <AUDIO ID>" % (path)
+    print "Usage: %s --debug-references <BNK|DB> <ID>" % (path)
+    print
+    print "Add --profile[=<TRACE JSON>] to print the time, bytes and objects of each phase,"
+    print "optionally saving them as a Chrome trace."
+    print "Add --dedupe to write identical embedded WEMs only once in rebuilt soundbanks."
 
     sys.exit(1)
 
@@ -2546,23 +4809,108 @@ def main(argc, argv):
     folder = None
     playlist_id = None
     debug_id = None
+    manifest = None
+    database = None
+    processes = None
+    budget = None
+    trace = None
+    filters = None
+    document = None
 
     argv = [arg.strip() for arg in argv]
+    dedupe = "--dedupe" in argv[1:]
+
+    if dedupe:
+        argv = [arg for arg in argv if arg != "--dedupe"]
+        argc = len(argv)
+
+        if argc < 2:
+            show_usage(argv[0])
+
+    profile = [arg for arg in argv[1:] if arg == "--profile" or arg.startswith("--profile=")]
+
+    if profile:
+        argv = [arg for arg in argv if arg not in profile]
+        argc = len(argv)
+        trace = profile[-1][len("--profile="):] or None
+
+        if argc < 2:
+            show_usage(argv[0])
+
+        Profile.enable()
+
+    if argv[1] == "--batch":
+        if argc not in (3, 4):
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_BATCH
+        manifest = argv[2]
+        processes = argv[3] if argc == 4 else None
+    elif argv[1] == "--batch-folder":
+        if argc not in (4, 5):
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_BATCH_FOLDER
+        bnk = argv[2]
+        folder = argv[3]
+        processes = argv[4] if argc == 5 else None
+    elif argv[1] == "--index":
+        if argc not in (4, 5):
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_INDEX
+        folder = argv[2]
+        database = argv[3]
+        processes = argv[4] if argc == 5 else None
+    elif argv[1] == "--store":
+        if argc not in (4, 5):
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_STORE
+        bnk = argv[2]
+        folder = argv[3]
+        processes = argv[4] if argc == 5 else None
+    elif argv[1] == "--verify":
+        if argc not in (3, 4):
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_VERIFY
+        folder = argv[2]
+        processes = argv[3] if argc == 4 else None
+    elif argv[1] == "--shell":
+        if argc not in (2, 3):
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_SHELL
+        budget = argv[2] if argc == 3 else None
+    elif argv[1] == "--find":
+        if argc != 4:
+            show_usage(argv[0])
 
-    if argv[1] == "--music":
+        mode = Soundbank.MODE_FIND
+        bnk = argv[2]
+        debug_id = argv[3]
+    elif argv[1] == "--patch":
         if argc != 4:
             show_usage(argv[0])
 
+        mode = Soundbank.MODE_PATCH
+        bnk = argv[2]
+        folder = argv[3]
+    elif argv[1] == "--music":
+        if argc < 4:
+            show_usage(argv[0])
+
         mode = Soundbank.MODE_BUILD_MUSIC
         bnk = argv[2]
-        wem = argv[3]
+        wem = argv[3:]
     elif argv[1] == "--add-new-music":
-        if argc != 4:
+        if argc < 4:
             show_usage(argv[0])
         
         mode = Soundbank.MODE_ADD_NEW_MUSIC
         bnk = argv[2]
-        wem = argv[3]
+        wem = argv[3:]
     elif argv[1] == "--playlist-id-from-track":
         if argc != 4:
             show_usage(argv[0])
@@ -2584,13 +4932,21 @@ def main(argc, argv):
         mode = Soundbank.MODE_REIMPORT_PLAYLIST
         bnk = argv[2]
         playlist_id = argv[3]
-    elif argv[1] == "--dump-sounds":
+    elif argv[1] in ("--export-playlists", "--reimport-playlists"):
         if argc != 4:
             show_usage(argv[0])
 
+        mode = Soundbank.MODE_EXPORT_PLAYLISTS if argv[1] == "--export-playlists" else Soundbank.MODE_REIMPORT_PLAYLISTS
+        bnk = argv[2]
+        document = argv[3]
+    elif argv[1] == "--dump-sounds":
+        if argc < 4:
+            show_usage(argv[0])
+
         mode = Soundbank.MODE_DUMP_SOUNDS
         bnk = argv[2]
         folder = argv[3]
+        filters = parse_media_filters(argv[4:])
     elif argv[1] == "--debug":
         if argc != 3:
             show_usage(argv[0])
@@ -2625,6 +4981,13 @@ def main(argc, argv):
         mode = Soundbank.MODE_DEBUG_OWNER
         bnk = argv[2]
         debug_id = argv[3]
+    elif argv[1] == "--debug-references":
+        if argc != 4:
+            show_usage(argv[0])
+
+        mode = Soundbank.MODE_DEBUG_REFERENCES
+        bnk = argv[2]
+        debug_id = argv[3]
     else:
         if argc != 3:
             show_usage(argv[0])
@@ -2633,12 +4996,74 @@ def main(argc, argv):
         bnk = argv[1]
         folder = argv[2]
 
+    if processes is not None:
+        try:
+            processes = int(processes)
+        except ValueError:
+            raise SyntaxError("Processes is not an integer")
+
+        if processes < 1:
+            raise SyntaxError("Invalid processes")
+
+    if mode == Soundbank.MODE_SHELL:
+        if budget is not None:
+            try:
+                budget = int(budget)
+            except ValueError:
+                raise SyntaxError("Budget is not an integer")
+
+            if budget < 1:
+                raise SyntaxError("Invalid budget")
+        else:
+            budget = SBShell.BUDGET
+
+        try:
+            SBShell(budget).cmdloop()
+        except KeyboardInterrupt:
+            print
+
+        sys.exit(0)
+
+    if mode == Soundbank.MODE_BATCH:
+        if not manifest:
+            raise SyntaxError("Invalid manifest")
+
+        ok = batch_rebuild(read_manifest(manifest), processes, dedupe)
+        sys.exit(0 if ok else 1)
+
+    if mode == Soundbank.MODE_INDEX:
+        if not folder or not database:
+            raise SyntaxError("Invalid folder or database")
+
+        ok = SBCorpus(database, True).update(folder, processes)
+        sys.exit(0 if ok else 1)
+
+    if mode == Soundbank.MODE_STORE:
+        if not bnk or not folder:
+            raise SyntaxError("Invalid bnk folder or store")
+
+        ok = WEMStore(folder).extract(bnk, processes)
+        sys.exit(0 if ok else 1)
+
+    if mode == Soundbank.MODE_VERIFY:
+        if not folder:
+            raise SyntaxError("Invalid bnk file or folder")
+
+        ok = batch_verify(find_banks(folder) if os.path.isdir(folder) else [folder], processes)
+        sys.exit(0 if ok else 1)
+
     if not bnk:
         raise SyntaxError("Invalid bnk file")
 
     if not wem and wem is not None:
         raise SyntaxError("Invalid wem file")
 
+    if mode in (Soundbank.MODE_BUILD_MUSIC, Soundbank.MODE_ADD_NEW_MUSIC):
+        if not all(wem):
+            raise SyntaxError("Invalid wem file")
+
+        wem = find_wems(wem)
+
     if wid is not None:
         try:
             wid = int(wid)
@@ -2648,6 +5073,13 @@ def main(argc, argv):
     if not folder and folder is not None:
         raise SyntaxError("Invalid folder")
 
+    if not document and document is not None:
+        raise SyntaxError("Invalid playlists file")
+
+    if mode == Soundbank.MODE_BATCH_FOLDER:
+        ok = batch_rebuild(find_jobs(bnk, folder), processes, dedupe)
+        sys.exit(0 if ok else 1)
+
     if playlist_id is not None:
         try:
             playlist_id = int(playlist_id)
@@ -2660,9 +5092,25 @@ def main(argc, argv):
         except ValueError:
             raise SyntaxError("Debug ID is not an integer")
 
+    if mode == Soundbank.MODE_FIND:
+        SBCorpus(bnk).find(debug_id)
+        sys.exit(0)
+
+    if mode in (Soundbank.MODE_PLAYLIST_ID, Soundbank.MODE_DEBUG_OWNER, Soundbank.MODE_DEBUG_REFERENCES) and SBCorpus.is_corpus(bnk):
+        corpus = SBCorpus(bnk)
+
+        if mode == Soundbank.MODE_PLAYLIST_ID:
+            corpus.get_playlist_ids(wid)
+        elif mode == Soundbank.MODE_DEBUG_OWNER:
+            corpus.debug_owner(debug_id)
+        else:
+            corpus.debug_references(debug_id)
+
+        sys.exit(0)
+
     sys.stdout.write("Reading soundbank...")
-    soundbank = Soundbank(bnk)
-    soundbank.read()
+    soundbank = Soundbank(bnk, mode in Soundbank.MODES_QUERY)
+    soundbank.read(mode == Soundbank.MODE_DUMP_SOUNDS and not filters[2])
     sys.stdout.write("Done!\n")
 
     if mode == Soundbank.MODE_DEBUG:
@@ -2680,17 +5128,27 @@ def main(argc, argv):
     elif mode == Soundbank.MODE_DEBUG_OWNER:
         print
         soundbank.debug_owner(debug_id)
+    elif mode == Soundbank.MODE_DEBUG_REFERENCES:
+        print
+        soundbank.debug_references(debug_id)
     elif mode == Soundbank.MODE_BUILD_MUSIC:
         sys.stdout.write("Rebuilding music...")
         soundbank.rebuild_music(wem)
-        soundbank.build_bnk()
+        soundbank.build_bnk(dedupe=dedupe)
         sys.stdout.write("Done!\n")
     elif mode == Soundbank.MODE_ADD_NEW_MUSIC:
         sys.stdout.write("Adding new music...")
-        objID = soundbank.add_music(wem)
-        soundbank.build_bnk()
+        added = soundbank.add_musics(wem)
+        soundbank.build_bnk(dedupe=dedupe)
         sys.stdout.write("Done!\n")
-        print "[*] Music segment object ID: '%i'" % (objID)
+
+        if len(added) == 1:
+            print "[*] Music segment object ID: '%i'" % (added[0][1])
+        else:
+            print "wem_id,segment_id"
+
+            for (mid, objID) in added:
+                print "%i,%i" % (mid, objID)
     elif mode == Soundbank.MODE_PLAYLIST_ID:
         print
         soundbank.get_playlist_ids(wid)
@@ -2701,12 +5159,39 @@ def main(argc, argv):
     elif mode == Soundbank.MODE_REIMPORT_PLAYLIST:
         sys.stdout.write("Reimporting playlist...")
         soundbank.reimport_playlist(playlist_id)
-        soundbank.build_bnk()
+        soundbank.build_bnk(dedupe=dedupe)
+        sys.stdout.write("Done!\n")
+    elif mode == Soundbank.MODE_EXPORT_PLAYLISTS:
+        sys.stdout.write("Exporting playlists...")
+        count = soundbank.export_playlists(document)
         sys.stdout.write("Done!\n")
+        print "[*] Playlists: %i" % (count)
+    elif mode == Soundbank.MODE_REIMPORT_PLAYLISTS:
+        sys.stdout.write("Reimporting playlists...")
+        count = soundbank.reimport_playlists(document)
+        soundbank.build_bnk(dedupe=dedupe)
+        sys.stdout.write("Done!\n")
+        print "[*] Playlists: %i" % (count)
     elif mode == Soundbank.MODE_DUMP_SOUNDS:
         sys.stdout.write("Dumping sounds...")
-        soundbank.dump_sounds(folder)
+        (dumped, unchanged) = soundbank.dump_sounds(folder, *filters)
         sys.stdout.write("Done!\n")
+        print "[*] Dumped: %i, Unchanged: %i" % (dumped, unchanged)
+    elif mode == Soundbank.MODE_PATCH:
+        if not soundbank.data_index:
+            raise SoundbankError("Soundbank does not contains embedded files")
+
+        sys.stdout.write("Patching sounds...")
+        soundbank.read_wems(folder)
+
+        if soundbank.patch_bnk():
+            sys.stdout.write("Done!\n")
+        else:
+            sys.stdout.write("Does not fit!\n")
+            sys.stdout.write("Rebuilding sounds...")
+            soundbank.rebuild_data()
+            soundbank.build_bnk(dedupe=dedupe)
+            sys.stdout.write("Done!\n")
     else:
         if not soundbank.data_index:
             raise SoundbankError("Soundbank does not contains embedded files")
@@ -2714,11 +5199,17 @@ def main(argc, argv):
         sys.stdout.write("Rebuilding sounds...")
         soundbank.read_wems(folder)
         soundbank.rebuild_data()
-        soundbank.build_bnk()
+        soundbank.build_bnk(dedupe=dedupe)
         sys.stdout.write("Done!\n")
 
     del soundbank
 
+    if Profile.enabled:
+        Profile.report()
+
+        if trace is not None:
+            Profile.save_trace(trace)
+
     sys.exit(0)
 
 if __name__ == "__main__":